@@ -1,5 +1,7 @@
+import gc
 import json
 import os
+import tracemalloc
 from datetime import datetime
 from typing import List
 
@@ -17,6 +19,7 @@ MAX_RULE = 1000
 MAX_EVENT = 100
 MAX_LIST_VALUES = 100
 MAX_LIST_VALUES_EVENT = 10
+MAX_RULE_FOOTPRINT = 50000
 
 
 class RoutingBenchMark:
@@ -768,6 +771,31 @@ class RoutingBenchMark:
         end_time = datetime.now()
         print(f"{self.test4_GREATER_values_message.__name__}: {(end_time - start_time).total_seconds()}")
 
+    def test_memory_footprint(self):
+        """Memory test, measuring the memory allocated to load:
+        - 50000 rules with EQUALS, STARTSWITH, NETWORK, EXISTS and (one every three) KEYWORD filters, split among 50 tags
+        """
+        rules = {}
+        for i in range(MAX_RULE_FOOTPRINT):
+            filters = [
+                {"type": "EQUALS", "key": "wheel_model", "value": [f"model{i}", f"alt{i}"]},
+                {"type": "STARTSWITH", "key": "frame.name", "value": [f"frame{i % 97}"]},
+                {"type": "NETWORK", "key": "src_addr", "value": [f"10.{i % 256}.{i // 256 % 256}.0/24"]},
+                {"type": "EXISTS", "key": "color"},
+            ]
+            if i % 3 == 0:
+                filters.append({"type": "KEYWORD", "key": "description", "value": ["fast", f"keyword{i}"]})
+            output = {"Workshop": {"workers_needed": i % 5}, "Lab": {"workers_needed": 1}} if i % 2 else {"Workshop": {"workers_needed": 1}}
+            rules.setdefault(f"tag{i % 50}", []).append({"id": f"rule-{i}", "filters": filters, "streams": output})
+        gc.collect()
+        tracemalloc.start()
+        routing = Routing()
+        routing.load_from_dicts([{"streams": {"rules": rules}}])
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{self.test_memory_footprint.__name__}: {size / 2**20:.1f} MiB, {size / routing.count():.0f} bytes per rule")
+
 
 def main():
     routing_benchmark = RoutingBenchMark()
@@ -803,6 +831,7 @@ def main():
     routing_benchmark.test2_GREATER_key_exists()
     routing_benchmark.test3_GREATER_list_values()
     routing_benchmark.test4_GREATER_values_message()
+    routing_benchmark.test_memory_footprint()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,33 @@
+import asyncio
+import contextlib
 import copy
+import dataclasses
+import datetime
+import functools
+import io
 import json
+import logging
 import os
+import pickle
+import tempfile
+import time
 import unittest
+import unittest.mock
 
 from IPy import IP
+from routingfilter.__main__ import main as routingfilter_main
+from routingfilter.__main__ import read_events
+from routingfilter.clock import BatchClock, Clock, CoarseClock, SystemClock
+from routingfilter.dictquery import CachedDictQuery, DictQuery, FieldPath
 from routingfilter.filters import filters
+from routingfilter.filters.automaton import AhoCorasick, Trie
+from routingfilter.filters.results import Results
+from routingfilter.filters.rule import EQUALS_INDEX_MAX_VALUES, FILTER_OBSERVATIONS_MIN, Rule, RuleManager
+from routingfilter.filters.stream import Stream
+from routingfilter.loader import READ_CHUNK_SIZE, RuleFileScanner
+from routingfilter.parallel import ParallelRouting
 from routingfilter.routing import Routing
+from routingfilter.stats import TOTAL_KEY, CountMinStats, ExactStats, Stats, TopKStats, TotalStats
 
 
 def load_test_data(name):
@@ -169,6 +191,51 @@ class RoutingTestCase(unittest.TestCase):
         res = self.routing.match(self.test_event_18)
         self.assertEqual(2, len(res))
 
+    def test_results_output_copy(self):
+        rule = Rule(uid="output-123", output={"Workshop": {"tools": ["wrench"]}, "Lab": {"workers_needed": 2}, "customer": {"name": "Bob"}})
+        rule.add_filter(filters.AllFilter())
+        # outputs computed in advance for every set of keys in routing history, except none and all the keys
+        self.assertEqual(len(rule._outputs), 6)
+        event = {"certego": {"routing_history": {"Lab": "2023-06-06T18:00:00.000Z"}}}
+        result = rule.match(CachedDictQuery(event))
+        self.assertEqual(result, Results(rules="output-123", output={"Workshop": {"tools": ["wrench"]}, "customer": {"name": "Bob"}}))
+        self.assertIn("Workshop", event["certego"]["routing_history"])
+        self.assertNotIn("customer", event["certego"]["routing_history"])
+        # the customer output is extracted and the output can be changed without affecting the rule
+        self.assertEqual(result.to_dict(), {"output": {"name": "Bob"}, "rules": "output-123"})
+        result.output["name"] = "Alice"
+        result = rule.match(CachedDictQuery({"certego": {"routing_history": {}}}))
+        self.assertEqual(result.output, {"name": "Bob"})
+        result.output = {"name": "Alice"}
+        self.assertEqual(repr(result), "Results(rules='output-123', output={'name': 'Alice'})")
+
+    def test_results_dataclass(self):
+        rule = Rule(uid="output-123", output={"Workshop": {"tools": ["wrench"]}})
+        rule.add_filter(filters.AllFilter())
+        result = rule.match(CachedDictQuery({"certego": {"routing_history": {}}}))
+        self.assertListEqual([field.name for field in dataclasses.fields(result)], ["rules", "output"])
+        # the dataclass functions read copies of the shared output
+        as_dict = dataclasses.asdict(result)
+        self.assertDictEqual(as_dict, {"rules": "output-123", "output": {"Workshop": {"tools": ["wrench"]}}})
+        replaced = dataclasses.replace(result, rules="output-456")
+        replaced.output["Workshop"]["tools"].append("hammer")
+        self.assertEqual(rule.output["Workshop"]["tools"], ["wrench"])
+        self.assertNotEqual(replaced, result)
+        self.assertEqual(dataclasses.replace(replaced, rules="output-123", output=result.output), result)
+
+    def test_results_output_many_keys(self):
+        output = {f"Stream{i}": {"workers_needed": i} for i in range(10)}
+        rule = Rule(uid="output-123", output=output)
+        rule.add_filter(filters.AllFilter())
+        # too many keys: outputs are computed when they are needed
+        self.assertEqual(len(rule._outputs), 0)
+        result = rule.match(CachedDictQuery({"certego": {"routing_history": {"Stream0": "2023-06-06T18:00:00.000Z"}}}))
+        self.assertEqual(len(rule._outputs), 1)
+        self.assertEqual(len(result.output), 9)
+        result.output["Stream1"]["workers_needed"] = 0
+        self.assertEqual(rule.output["Stream1"]["workers_needed"], 1)
+        self.assertIsNone(rule.match(CachedDictQuery({"certego": {"routing_history": output}})))
+
     def test_rule_1(self):
         # Test rule loading and applying with full output
         self.routing.load_from_dicts([load_test_data("test_rule_1_equals")])
@@ -390,9 +457,42 @@ class RoutingTestCase(unittest.TestCase):
         self.routing.load_from_dicts([load_test_data("test_rule_33_network_multiple_variables")], variables={"$HOME_NET": ["192.168.1.0/24"]})
         self.assertDictEqual(self.routing.variables, {"$HOME_NET": ["192.168.1.0/24"]})
         values = self.routing.streams._ruleManagers["ip_traffic"]._rules[0]._filters[0]._value
-        self.assertEqual([IP("192.168.1.0/24"), IP("10.0.0.1")], values)
+        self.assertEqual((IP("192.168.1.0/24"), IP("10.0.0.1")), values)
         self.assertTrue(self.routing.match(self.test_event_4))
 
+    def test_shared_variables(self):
+        variables = {"$BLOCKLIST": [f"Host-{i}" for i in range(EQUALS_INDEX_MAX_VALUES + 1)], "$SINGLE": "Host-1"}
+        rules = {
+            "streams": {
+                "rules": {
+                    tag: [
+                        {"id": f"{tag}-src", "filters": [{"type": "EQUALS", "key": "src", "value": "$BLOCKLIST"}, {"type": "EXISTS", "key": "dst"}]},
+                        {"id": f"{tag}-dst", "filters": [{"type": "EQUALS", "key": "dst", "value": ["$BLOCKLIST"]}]},
+                        {"id": f"{tag}-prefix", "filters": [{"type": "STARTSWITH", "key": "dst", "value": ["$SINGLE", "$UNDEFINED"]}]},
+                    ]
+                    for tag in ("tag1", "tag2")
+                }
+            }
+        }
+        source = copy.deepcopy((rules, variables))
+        self.routing.load_from_dicts([rules], variables=variables, intern_filters=False)
+        # neither the rules nor the variables are changed
+        self.assertEqual((rules, variables), source)
+        self.assertEqual(self.routing.count(), 6)
+        rule_managers = self.routing.streams._ruleManagers
+        equal_values = [rule._filters[0]._value for rule_manager in rule_managers.values() for rule in rule_manager._rules[:2]]
+        self.assertEqual(equal_values[0], frozenset(value.lower() for value in variables["$BLOCKLIST"]))
+        # a single set for all the filters using the variable
+        self.assertTrue(all(values is equal_values[0] for values in equal_values))
+        self.assertIs(rule_managers["tag1"]._rules[2]._filters[0]._value, rule_managers["tag2"]._rules[2]._filters[0]._value)
+        self.assertEqual(rule_managers["tag1"]._rules[2]._filters[0]._value, ("host-1",))
+        # large sets are not indexed
+        self.assertEqual(rule_managers["tag1"]._index[0], {})
+        self.assertEqual(self.routing.match({"tags": "tag1", "src": "HOST-2", "dst": "other"})[0].rules, "tag1-src")
+        self.assertEqual(self.routing.match({"tags": "tag2", "dst": "HOST-1000"})[0].rules, "tag2-dst")
+        self.assertEqual(self.routing.match({"tags": "tag2", "dst": "host-10"})[0].rules, "tag2-dst")
+        self.assertFalse(self.routing.match({"tags": "tag2", "dst": "other"}))
+
     def test_rule_upper_case_value(self):
         self.routing.load_from_dicts([load_test_data("test_rule_34_upper_case")])
         self.assertTrue(self.routing.match(load_test_data("test_event_upper_case_value")))
@@ -477,6 +577,27 @@ class RoutingTestCase(unittest.TestCase):
         self.assertDictEqual(self.routing.get_stats(delete=True), expected_stats)
         self.assertDictEqual(self.routing.get_stats(), {"streams": {"exists-fh0wery": {}, "equals-fbh49ry29": {}}, "customers": {"customer-dh8rh9fow": {}}})
 
+    def test_stats_backends(self):
+        routing = Routing(stats=functools.partial(TopKStats, 2))
+        routing.load_from_dicts([load_test_data("test_rule_5_exists")])
+        for name in ["one", "one", "two", "three", "one"]:
+            event = copy.deepcopy(self.test_event_8)
+            event["rule"] = {"name": name}
+            routing.match(event)
+        # "three" replaced "two", inheriting its hit
+        self.assertDictEqual(routing.get_stats()["streams"], {"exists-fh0wery": {"one": 3, "three": 2}})
+        routing.merge_stats({"streams": {"exists-fh0wery": {"two": 5}}})
+        self.assertDictEqual(routing.get_stats(delete=True)["streams"], {"exists-fh0wery": {"one": 3, "two": 7}})
+        self.assertDictEqual(routing.get_stats()["streams"], {"exists-fh0wery": {}})
+        # reloaded rules use the same stats factory
+        routing.reload([load_test_data("test_rule_5_exists")])
+        self.assertTrue(all(isinstance(rule._stats, TopKStats) for rule_manager in routing.streams._ruleManagers.values() for rule in rule_manager.rules()))
+        routing = Routing(stats=TotalStats)
+        routing.load_from_dicts([load_test_data("test_rule_5_exists")])
+        routing.match(copy.deepcopy(self.test_event_8))
+        routing.match(copy.deepcopy(self.test_event_8))
+        self.assertDictEqual(routing.get_stats()["streams"], {"exists-fh0wery": {TOTAL_KEY: 2}})
+
     def test_count(self):
         rule_list = [
             load_test_data("test_rule_1_equals"),
@@ -504,6 +625,913 @@ class RoutingTestCase(unittest.TestCase):
         match = self.routing.match(self.test_event_20)
         self.assertFalse(match)
 
+    def test_equals_index(self):
+        rules = [
+            {"id": "equals-1", "filters": [{"type": "EQUALS", "key": "wheel_model", "value": ["RacePro"]}], "streams": {"Workshop": {}}},
+            {"id": "not-equals", "filters": [{"type": "NOT_EQUALS", "key": "frame", "value": ["carbon"]}], "streams": {"Lab": {}}},
+            {
+                "id": "equals-2",
+                "filters": [{"type": "EXISTS", "key": "frame"}, {"type": "EQUALS", "key": ["wheel_model", "gears"], "value": ["Superlight", "1x12"]}],
+                "streams": {"Workshop": {}},
+            },
+            {"id": "exists", "filters": [{"type": "EXISTS", "key": "wheel_model"}], "streams": {"Workshop": {}}},
+        ]
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": rules}}}])
+        rule_manager = self.routing.streams._ruleManagers["mountain_bike"]
+        equal_index, scan_positions, _, _ = rule_manager._index
+        self.assertEqual(scan_positions, [1, 3])
+        self.assertDictEqual(equal_index["wheel_model"], {"racepro": (0,), "superlight": (2,), "1x12": (2,)})
+        self.assertDictEqual(equal_index["gears"], {"superlight": (2,), "1x12": (2,)})
+
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "RACEPRO", "frame": "carbon"})[0].rules, "equals-1")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "Superlight", "frame": "aluminium"})[0].rules, "not-equals")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "gears": ["2x10", "1x12"], "frame": "carbon"})[0].rules, "equals-2")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "Superlight", "frame": "carbon"})[0].rules, "equals-2")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "Other", "frame": "carbon"})[0].rules, "exists")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "frame": "carbon"}), [])
+
+    def test_required_keys_precheck(self):
+        rules = [
+            {
+                "id": "network",
+                "filters": [{"type": "NETWORK", "key": "src_addr", "value": ["10.0.0.0/8"]}, {"type": "EXISTS", "key": ["frame", "gears"]}],
+                "streams": {"Workshop": {}},
+            },
+            {
+                "id": "regexp",
+                "filters": [{"type": "REGEXP", "key": "wheel_model", "value": ["^Super"]}, {"type": "TYPEOF", "key": "frame.size", "value": ["str"]}],
+                "streams": {"Workshop": {}},
+            },
+            {"id": "not-equals", "filters": [{"type": "NOT_EQUALS", "key": "frame", "value": ["carbon"]}], "streams": {"Lab": {}}},
+        ]
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": rules}}}])
+        rule_manager = self.routing.streams._ruleManagers["mountain_bike"]
+        network, regexp, not_equals = rule_manager._rules
+        self.assertEqual(network.required_keys(), {"src_addr"})
+        self.assertEqual(regexp.required_keys(), {"wheel_model", "frame.size"})
+        self.assertEqual(not_equals.required_keys(), frozenset())
+        _, _, precheck_keys, masks = rule_manager._index
+        self.assertEqual(len(precheck_keys), 3)
+        self.assertEqual(masks[2], 0)
+        # frame.size is missing, since frame is not a dictionary
+        event = CachedDictQuery({"frame": "carbon", "wheel_model": "Superlight", "certego": {"routing_history": {}}})
+        with unittest.mock.patch.object(Rule, "match", autospec=True, side_effect=Rule.match) as match:
+            self.assertIsNone(rule_manager.match(event, "mountain_bike"))
+        self.assertEqual([call.args[0] for call in match.call_args_list], [not_equals])
+        self.assertEqual(
+            self.routing.match({"tags": "mountain_bike", "frame": "carbon", "wheel_model": "Superlight", "src_addr": "10.0.0.1"})[0].rules, "network"
+        )
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "frame": {"size": "M"}, "wheel_model": "Superlight"})[0].rules, "regexp")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "frame": {"size": "M"}})[0].rules, "not-equals")
+
+    def test_keyword_automaton(self):
+        keywords = [f"keyword-{i}" for i in range(filters.KEYWORD_AUTOMATON_THRESHOLD)] + ["Light"]
+        rule = {
+            "streams": {"rules": {"mountain_bike": [{"filters": [{"type": "KEYWORD", "key": "wheel_model", "value": keywords}], "streams": {"Workshop": {}}}]}}
+        }
+        self.routing.load_from_dicts([rule])
+        keyword_filter = self.routing.streams._ruleManagers["mountain_bike"]._rules[0]._filters[0]
+        self.assertIsNotNone(keyword_filter._automaton)
+        self.assertTrue(self.routing.match(self.test_event_1))
+        self.assertFalse(self.routing.match(self.test_event_3))
+
+    def test_shared_keywords(self):
+        rules = [
+            {"id": "keyword-1", "filters": [{"type": "KEYWORD", "key": "wheel_model", "value": ["race", "pro"]}], "streams": {"Workshop": {}}},
+            {"id": "keyword-2", "filters": [{"type": "KEYWORD", "key": "frame", "value": ["carbon"]}], "streams": {"Workshop": {}}},
+            {
+                "id": "keyword-3",
+                "filters": [{"type": "KEYWORD", "key": "wheel_model", "value": ["light"]}, {"type": "KEYWORD", "key": "frame", "value": ["alu"]}],
+                "streams": {"Workshop": {}},
+            },
+            {"id": "keyword-4", "filters": [{"type": "KEYWORD", "key": "wheel_model", "value": ["super"]}], "streams": {"Workshop": {}}},
+        ]
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": rules}}}], share_keywords=True)
+        rule_list = self.routing.streams._ruleManagers["mountain_bike"]._rules
+        self.assertIs(rule_list[0]._filters[0]._group, rule_list[3]._filters[0]._group)
+        self.assertIs(rule_list[1]._filters[0]._group, rule_list[2]._filters[1]._group)
+        self.assertEqual(self.routing.match(self.test_event_1)[0].rules, "keyword-3")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": ["Superlight"], "frame": "steel"})[0].rules, "keyword-4")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "RacePro", "frame": "steel"})[0].rules, "keyword-1")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "Heavy", "frame": "steel"}), [])
+
+    def test_startswith_endswith_trie(self):
+        prefixes = [f"prefix-{i}" for i in range(filters.AFFIX_TRIE_THRESHOLD)]
+        rules = [
+            {"id": "startswith", "filters": [{"type": "STARTSWITH", "key": "wheel_model", "value": prefixes + ["SUPER"]}], "streams": {"Workshop": {}}},
+            {"id": "endswith", "filters": [{"type": "ENDSWITH", "key": "wheel_model", "value": prefixes + ["PRO"]}], "streams": {"Workshop": {}}},
+        ]
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": rules}}}])
+        rule_list = self.routing.streams._ruleManagers["mountain_bike"]._rules
+        self.assertIsNotNone(rule_list[0]._filters[0]._trie)
+        self.assertIsNotNone(rule_list[1]._filters[0]._trie)
+        self.assertEqual(self.routing.match(self.test_event_1)[0].rules, "startswith")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": ["Light", "RacePro"]})[0].rules, "endswith")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "Prefix-1 Light"})[0].rules, "startswith")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "prefix"}), [])
+
+    def test_network_intervals(self):
+        network_filter = filters.NetworkFilter("ip", ["10.0.0.0/8", "10.1.0.0/16", "192.168.1.0/24", "192.168.2.1", "2001:db8::/32"])
+        starts, ends = network_filter._intervals[0]
+        self.assertEqual(starts, (IP("10.0.0.0").int(), IP("192.168.1.0").int(), IP("192.168.2.1").int()))
+        self.assertEqual(ends, (IP("10.255.255.255").int(), IP("192.168.1.255").int(), IP("192.168.2.1").int()))
+        for ip_address, expected in [
+            ("10.1.2.3", True),
+            ("10.2.0.0/16", True),
+            ("11.0.0.0", False),
+            ("192.168.1.0/23", False),
+            ("192.168.2.1", True),
+            ("192.168.2.2", False),
+            ("2001:db8::1", True),
+            ("2001:db9::1", False),
+            ("::ffff:10.1.2.3", False),
+            ("not an ip", False),
+        ]:
+            self.assertEqual(network_filter._check_network(ip_address), expected, ip_address)
+
+    def test_fused_regexps(self):
+        regexp_filter = filters.RegexpFilter("wheel_model", ["^Super", "(a)\\1", "Pro$", "(?i)^race"])
+        self.assertEqual(regexp_filter._fused.pattern, "(?:^Super)|(?:Pro$)")
+        self.assertEqual([regex.pattern for regex in regexp_filter._unfused], ["(a)\\1", "(?i)^race"])
+        for value, expected in [("Superlight", True), ("RacePro", True), ("aa", True), ("RACE", True), ("light", False)]:
+            self.assertEqual(regexp_filter.match(DictQuery({"wheel_model": value})), expected, value)
+
+    def test_shared_regexps(self):
+        rules = [
+            {"id": "regexp-1", "filters": [{"type": "REGEXP", "key": "wheel_model", "value": ["light$"]}], "streams": {"Workshop": {}}},
+            {"id": "regexp-2", "filters": [{"type": "REGEXP", "key": "wheel_model", "value": ["^Super", "^Race"]}], "streams": {"Workshop": {}}},
+            {"id": "regexp-3", "filters": [{"type": "REGEXP", "key": "wheel_model", "value": ["(P)\\1"]}], "streams": {"Workshop": {}}},
+            {"id": "regexp-4", "filters": [{"type": "REGEXP", "key": "wheel_model", "value": ["^Mega", "(o)\\1"]}], "streams": {"Workshop": {}}},
+        ]
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": rules}}}], share_regexps=True)
+        rule_list = self.routing.streams._ruleManagers["mountain_bike"]._rules
+        self.assertIsNotNone(rule_list[0]._filters[0]._group)
+        self.assertIs(rule_list[0]._filters[0]._group, rule_list[3]._filters[0]._group)
+        self.assertIsNone(rule_list[2]._filters[0]._group)
+        self.assertEqual(self.routing.match(self.test_event_1)[0].rules, "regexp-1")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "SuperPro"})[0].rules, "regexp-2")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "PP"})[0].rules, "regexp-3")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": ["Heavy", "Zoom"]})[0].rules, "regexp-4")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "Heavy"}), [])
+
+    def test_interned_filters(self):
+        rules = [
+            {
+                "id": "interned-1",
+                "filters": [{"type": "NETWORK", "key": "src_addr", "value": ["10.0.0.0/8"]}, {"type": "EQUALS", "key": "wheel_model", "value": ["Superlight"]}],
+                "streams": {"Workshop": {}},
+            },
+            {
+                "id": "interned-2",
+                "filters": [{"type": "NETWORK", "key": "src_addr", "value": "10.0.0.0/8"}, {"type": "EQUALS", "key": "wheel_model", "value": ["SUPERLIGHT"]}],
+                "streams": {"Lab": {}},
+            },
+            {"id": "interned-3", "filters": [{"type": "NETWORK", "key": "dst_addr", "value": ["10.0.0.0/8"]}], "streams": {"Lab": {}}},
+        ]
+        road_bike_rules = [{"id": "interned-4", "filters": [rules[0]["filters"][0]], "streams": {"Lab": {}}}]
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": rules}}}, {"streams": {"rules": {"road_bike": road_bike_rules}}}])
+        rule_1, rule_2, rule_3 = self.routing.streams._ruleManagers["mountain_bike"]._rules
+        rule_4 = self.routing.streams._ruleManagers["road_bike"]._rules[0]
+        self.assertIs(rule_1._filters[0], rule_2._filters[0])
+        self.assertIs(rule_1._filters[0], rule_4._filters[0])
+        self.assertIs(rule_1._filters[1], rule_2._filters[1])
+        self.assertIsNot(rule_1._filters[0], rule_3._filters[0])
+        self.assertTrue(rule_1._filters[0]._shared)
+        self.assertFalse(rule_3._filters[0]._shared)
+        # the result of a shared filter is computed once per event
+        event = CachedDictQuery({"src_addr": "10.1.1.1", "wheel_model": "Other", "certego": {"routing_history": {}}})
+        self.assertIsNone(rule_1.match(event))
+        self.assertIn(rule_1._filters[0], event._memo)
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "src_addr": "10.1.1.1", "wheel_model": "superlight"})[0].rules, "interned-1")
+        self.assertEqual(self.routing.match({"tags": "road_bike", "src_addr": "10.1.1.1"})[0].rules, "interned-4")
+
+    def test_interned_filters_without_values(self):
+        rules = [
+            {
+                "id": f"exists-{i}",
+                "filters": [{"type": "EXISTS", "key": "wheel_model"}, {"type": "ALL"}, {"type": "EQUALS", "key": "frame", "value": f"frame-{i}"}],
+            }
+            for i in range(2)
+        ]
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": rules}}}])
+        rule_1, rule_2 = self.routing.streams._ruleManagers["mountain_bike"]._rules
+        self.assertIs(rule_1._filters[0], rule_2._filters[0])
+        self.assertIs(rule_1._filters[1], rule_2._filters[1])
+        self.assertTrue(rule_1._filters[0]._shared)
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "Superlight", "frame": "frame-1"})[0].rules, "exists-1")
+
+    def test_not_interned_filters(self):
+        rule = {"filters": [{"type": "NETWORK", "key": "src_addr", "value": ["10.0.0.0/8"]}], "streams": {"Workshop": {}}}
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": [copy.deepcopy(rule), copy.deepcopy(rule)]}}}], intern_filters=False)
+        rule_1, rule_2 = self.routing.streams._ruleManagers["mountain_bike"]._rules
+        self.assertIsNot(rule_1._filters[0], rule_2._filters[0])
+        self.assertFalse(rule_1._filters[0]._shared)
+
+    def test_reorder_filters(self):
+        rule = {
+            "id": "reordered",
+            "filters": [
+                {"type": "REGEXP", "key": "wheel_model", "value": ["^Super"]},
+                {"type": "TYPEOF", "key": "src_addr", "value": ["ip"]},
+                {"type": "NETWORK", "key": "src_addr", "value": ["10.0.0.0/8"]},
+                {"type": "EXISTS", "key": "wheel_model"},
+                {"type": "TYPEOF", "key": "wheel_model", "value": ["str"]},
+            ],
+            "streams": {"Workshop": {}},
+        }
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": [rule]}}}], reorder_filters=True)
+        rule_object = self.routing.streams._ruleManagers["mountain_bike"]._rules[0]
+        self.assertEqual(
+            [type(f) for f in rule_object._filters],
+            [filters.ExistFilter, filters.TypeofFilter, filters.NetworkFilter, filters.RegexpFilter, filters.TypeofFilter],
+        )
+        self.assertEqual(rule_object._filters[-1]._value, ("ip",))
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "src_addr": "10.1.1.1", "wheel_model": "Superlight"})[0].rules, "reordered")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "src_addr": "10.1.1.1"}), [])
+
+    def test_reorder_filters_non_scalar_values(self):
+        rule = {
+            "id": "non-scalar",
+            "filters": [
+                {"type": "NOT_EQUALS", "key": "wheel_size", "value": ["29"]},
+                {"type": "GREATER", "key": "wheel_size", "value": [26]},
+                {"type": "TYPEOF", "key": "wheel_size", "value": ["ip"]},
+            ],
+            "streams": {"Workshop": {}},
+        }
+        routing = Routing()
+        routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": [copy.deepcopy(rule)]}}}])
+        reordered_routing = Routing()
+        reordered_routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": [copy.deepcopy(rule)]}}}], reorder_filters=True)
+        # the cheap filters checked first by the reordered rule must not raise on values they cannot convert
+        for wheel_size in ({}, [{}], None, {"front": 29}):
+            event = {"tags": "mountain_bike", "wheel_size": wheel_size}
+            self.assertEqual(reordered_routing.match(copy.deepcopy(event)), routing.match(copy.deepcopy(event)))
+        for rule_object in (routing.streams._ruleManagers["mountain_bike"]._rules[0], reordered_routing.streams._ruleManagers["mountain_bike"]._rules[0]):
+            rule_object.compile()
+        for wheel_size in ({}, [{}], None):
+            event = {"tags": "mountain_bike", "wheel_size": wheel_size}
+            self.assertEqual(reordered_routing.match(copy.deepcopy(event)), routing.match(copy.deepcopy(event)))
+
+    def test_reorder_observed_filters(self):
+        rule = {
+            "id": "observed",
+            "filters": [{"type": "STARTSWITH", "key": "wheel_model", "value": ["Super"]}, {"type": "STARTSWITH", "key": "frame_size", "value": ["M"]}],
+            "streams": {"Workshop": {}},
+        }
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": [rule]}}}], compile_rules=True)
+        rule_object = self.routing.streams._ruleManagers["mountain_bike"]._rules[0]
+        wheel_model, frame_size = rule_object._filters
+        self.routing.observe_filters()
+        for i in range(FILTER_OBSERVATIONS_MIN):
+            self.routing.match({"tags": "mountain_bike", "wheel_model": "Superlight", "frame_size": "M" if i % 10 == 0 else "L"})
+        self.assertEqual(rule_object._observations, [[FILTER_OBSERVATIONS_MIN, 0], [FILTER_OBSERVATIONS_MIN, FILTER_OBSERVATIONS_MIN * 9 // 10]])
+        # static order keeps the filters with the same cost as they are
+        self.routing.reorder_filters()
+        self.assertEqual(rule_object._filters, (wheel_model, frame_size))
+        self.routing.reorder_filters(observed=True)
+        self.assertEqual(rule_object._filters, (frame_size, wheel_model))
+        self.assertEqual(rule_object._observations, [[0, 0], [0, 0]])
+        self.assertIsNotNone(rule_object._compiled)
+        self.routing.observe_filters(False)
+        self.assertIsNone(rule_object._observations)
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "Superlight", "frame_size": "M"})[0].rules, "observed")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "Superlight", "frame_size": "L"}), [])
+
+    def test_reload(self):
+        rules = [
+            {"id": "kept", "filters": [{"type": "EQUALS", "key": "wheel_model", "value": ["$WHEELS"]}], "streams": {"Workshop": {}}},
+            {"id": "removed", "filters": [{"type": "EQUALS", "key": "frame", "value": ["carbon"]}], "streams": {"Lab": {}}},
+        ]
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": rules}}}], variables={"$WHEELS": ["Superlight"]})
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "Superlight", "rule": {"name": "one"}})[0].rules, "kept")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "frame": "carbon", "rule": {"name": "one"}})[0].rules, "removed")
+        old_streams = self.routing.streams
+        new_rules = [
+            {"id": "added", "filters": [{"type": "EQUALS", "key": "gears", "value": ["1x12"]}], "streams": {"Lab": {}}},
+            {"id": "kept", "filters": [{"type": "EQUALS", "key": "wheel_model", "value": ["$WHEELS", "RacePro"]}], "streams": {"Workshop": {}}},
+        ]
+        self.routing.reload([{"streams": {"rules": {"road_bike": new_rules}}}], compile_rules=True)
+        self.assertEqual(self.routing.count(), 2)
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "frame": "carbon"}), [])
+        # the current variables are used
+        self.assertEqual(self.routing.match({"tags": "road_bike", "wheel_model": "Superlight", "rule": {"name": "two"}})[0].rules, "kept")
+        self.assertEqual(self.routing.match({"tags": "road_bike", "gears": "1x12", "rule": {"name": "two"}})[0].rules, "added")
+        self.assertIsNotNone(self.routing.streams._ruleManagers["road_bike"]._rules[1]._compiled)
+        # a match started before the reload ends with the old rules, and its hits are counted
+        self.assertEqual(
+            old_streams.match(CachedDictQuery({"tags": "mountain_bike", "wheel_model": "Superlight", "certego": {"routing_history": {}}}), "tags")[0].rules,
+            "kept",
+        )
+        self.assertDictEqual(self.routing.get_stats()["streams"], {"added": {"two": 1}, "kept": {"one": 1, "two": 1, "unknown": 1}})
+        # if the new rules are invalid, the current ones are kept
+        with self.assertRaises(ValueError):
+            self.routing.reload([{"invalid": {"rules": {}}}])
+        self.assertEqual(self.routing.match({"tags": "road_bike", "gears": "1x12"})[0].rules, "added")
+
+    def test_upsert_remove_rule(self):
+        rules = [
+            {"id": "equals", "filters": [{"type": "EQUALS", "key": "wheel_model", "value": ["Superlight"]}], "streams": {"Workshop": {}}},
+            {"id": "exists", "filters": [{"type": "EXISTS", "key": "frame"}], "streams": {"Lab": {}}},
+            {"id": "startswith", "filters": [{"type": "STARTSWITH", "key": "frame", "value": ["carb"]}], "streams": {"Shop": {}}},
+        ]
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": rules}}}])
+        rule_manager = self.routing.streams._ruleManagers["mountain_bike"]
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "frame": "carbon", "rule": {"name": "one"}})[0].rules, "exists")
+        # replacing a rule keeps its position, its stats and the index
+        index = rule_manager._index
+        rule_id = self.routing.upsert_rule(
+            "streams",
+            "mountain_bike",
+            {"id": "exists", "filters": [{"type": "EQUALS", "key": "frame", "value": ["Carbon"]}], "streams": {"Lab": {}}},
+            compile_rule=True,
+        )
+        self.assertEqual(rule_id, "exists")
+        self.assertIs(rule_manager._index, index)
+        self.assertEqual([rule.uid for rule in rule_manager.rules()], ["equals", "exists", "startswith"])
+        equal_index, scan_positions, _, _ = rule_manager._index
+        self.assertEqual(scan_positions, [2])
+        self.assertDictEqual(equal_index["frame"], {"carbon": [1]})
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "frame": "carbon", "rule": {"name": "two"}})[0].rules, "exists")
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "frame": "carbo"})[0].rules, "startswith")
+        self.assertDictEqual(self.routing.get_stats()["streams"]["exists"], {"one": 1, "two": 1})
+        # new rules are added at the end, moved rules leave their tag
+        new_id = self.routing.upsert_rule("streams", "mountain_bike", {"filters": [{"type": "EXISTS", "key": "gears"}], "streams": {"Lab": {}}})
+        self.routing.upsert_rule("streams", "road_bike", rules[0])
+        self.assertEqual([rule.uid for rule in rule_manager.rules()], ["exists", "startswith", new_id])
+        self.assertEqual(self.routing.streams.get_rule_position("equals"), ("road_bike", 0))
+        self.assertEqual(self.routing.count(), 4)
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "gears": "1x12", "wheel_model": "Superlight"})[0].rules, new_id)
+        self.assertEqual(self.routing.match({"tags": "road_bike", "wheel_model": "Superlight"})[0].rules, "equals")
+        # removed rules leave an empty position until more than half of them are removed
+        self.assertTrue(self.routing.remove_rule("exists"))
+        self.assertFalse(self.routing.remove_rule("exists"))
+        self.assertIsNone(rule_manager._rules[1])
+        self.assertEqual(self.routing.count(), 3)
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "frame": "carbon"})[0].rules, "startswith")
+        self.assertTrue(self.routing.remove_rule("startswith"))
+        self.assertEqual(rule_manager._rules, [rule_manager.rules()[0]])
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "frame": "carbon", "gears": "1x12"})[0].rules, new_id)
+        # invalid rules change neither the rules nor the digest
+        digest = self.routing.rules_digest
+        with self.assertRaises(ValueError):
+            self.routing.upsert_rule("streams", "mountain_bike", {"id": "invalid", "filters": [{"type": "TYPEOF", "key": "frame", "value": ["bike"]}]})
+        with self.assertRaises(ValueError):
+            self.routing.upsert_rule("invalid", "mountain_bike", rules[0])
+        self.assertEqual(self.routing.rules_digest, digest)
+        self.assertEqual(self.routing.count(), 2)
+
+    def test_upsert_rule_tags(self):
+        rules = [
+            {"id": "superlight", "filters": [{"type": "EQUALS", "key": "wheel_model", "value": ["Superlight"]}], "streams": {"Workshop": {}}},
+            {"id": "racepro", "filters": [{"type": "EQUALS", "key": "wheel_model", "value": ["RacePro", "Superlight"]}], "streams": {"Shop": {}}},
+        ]
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": rules}}}])
+        stream = self.routing.streams
+        self.assertEqual(stream.get_rule_position("racepro"), ("mountain_bike", 1))
+        self.assertDictEqual(stream._rule_tags, {"superlight": "mountain_bike", "racepro": "mountain_bike"})
+        # the tags of the rules are followed without searching the rule managers
+        with unittest.mock.patch.object(RuleManager, "rules", side_effect=AssertionError):
+            self.routing.upsert_rule("streams", "road_bike", rules[1])
+            new_rule = {"id": "new", "filters": [{"type": "EQUALS", "key": "wheel_model", "value": ["Superlight"]}], "streams": {"Lab": {}}}
+            self.routing.upsert_rule("streams", "mountain_bike", new_rule)
+            # the indexed positions stay sorted
+            rule_manager = stream._ruleManagers["mountain_bike"]
+            self.assertDictEqual(rule_manager._index[0]["wheel_model"], {"superlight": [0, 2]})
+        self.assertTrue(self.routing.remove_rule("superlight"))
+        self.assertDictEqual(stream._rule_tags, {"racepro": "road_bike", "new": "mountain_bike"})
+        self.assertEqual(self.routing.match({"tags": "mountain_bike", "wheel_model": "Superlight"})[0].rules, "new")
+        self.assertEqual(self.routing.match({"tags": "road_bike", "wheel_model": "Superlight"})[0].rules, "racepro")
+        # loading rules rebuilds the tags
+        self.routing.load_from_dicts([{"streams": {"rules": {"gravel_bike": rules}}}])
+        self.assertEqual(stream.get_rule_position("superlight"), ("gravel_bike", 0))
+        # rules without id are not changed by upsert_rule
+        rule = {"filters": [{"type": "EXISTS", "key": "frame"}], "streams": {"Lab": {}}}
+        uid = self.routing.upsert_rule("streams", "gravel_bike", rule)
+        self.assertNotIn("id", rule)
+        self.assertEqual(stream.get_rule_position(uid), ("gravel_bike", 2))
+
+    def test_upsert_rule_changed_rule_managers(self):
+        rules = [{"id": "superlight", "filters": [{"type": "EQUALS", "key": "wheel_model", "value": ["Superlight"]}], "streams": {"Workshop": {}}}]
+        self.routing.load_from_dicts([{"streams": {"rules": {"mountain_bike": rules}}}])
+        stream = self.routing.streams
+        self.assertEqual(stream.get_rule_position("superlight"), ("mountain_bike", 0))
+        # rule managers deleted or added by the stream
+        stream.delete_rulemanager("mountain_bike")
+        self.assertFalse(self.routing.remove_rule("superlight"))
+        rule_manager = RuleManager("road_bike")
+        rule_object = Rule(uid="superlight", output={"Workshop": {}})
+        rule_object.add_filter(filters.AllFilter())
+        rule_manager.add_rule(rule_object)
+        stream.add_rulemanager(rule_manager)
+        self.assertEqual(stream.get_rule_position("superlight"), ("road_bike", 0))
+        self.routing.upsert_rule("streams", "mountain_bike", rules[0])
+        self.assertEqual([rule.uid for rule in stream._ruleManagers["mountain_bike"].rules()], ["superlight"])
+        self.assertEqual(rule_manager.count(), 0)
+        # rule managers changed directly
+        stream._ruleManagers["mountain_bike"].remove_rule("superlight")
+        rule_manager.add_rule(rule_object)
+        self.assertTrue(self.routing.remove_rule("superlight"))
+        self.assertEqual(self.routing.count(), 0)
+
+    def test_snapshot(self):
+        rule_list = [load_test_data("test_rule_4_multiple_filters"), load_test_data("test_rule_24_routing_history"), load_test_data("test_customer_1")]
+        self.routing.load_from_dicts(copy.deepcopy(rule_list))
+        self.routing.match(self.test_event_1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rules.snapshot")
+            self.routing.save_snapshot(path)
+            routing = Routing()
+            routing.load_snapshot(path, copy.deepcopy(rule_list))
+            self.assertEqual(routing.count(), self.routing.count())
+            self.assertEqual(routing.rules_digest, self.routing.rules_digest)
+            self.assertEqual([hits for stats in routing.get_stats().values() for hits in stats.values()], [{}] * routing.count())
+            for event in (self.test_event_1, self.test_event_2, self.test_event_3):
+                self.assertEqual(routing.match(copy.deepcopy(event)), self.routing.match(copy.deepcopy(event)))
+            self.assertEqual(
+                routing.match(copy.deepcopy(self.test_event_1), type_="customers"), self.routing.match(copy.deepcopy(self.test_event_1), type_="customers")
+            )
+            # the snapshot is checked against the source rules and the library version
+            with self.assertRaises(ValueError):
+                routing.load_snapshot(path, rule_list[:2])
+            with self.assertRaises(ValueError):
+                routing.load_snapshot(path, copy.deepcopy(rule_list), {"$WHEELS": ["Superlight"]})
+            with unittest.mock.patch("routingfilter.routing.__version__", "0.0.0"):
+                with self.assertRaises(ValueError):
+                    routing.load_snapshot(path)
+            with open(path, "wb") as file:
+                file.write(b"not a snapshot")
+            with self.assertRaises(ValueError):
+                routing.load_snapshot(path)
+        self.assertEqual(routing.count(), self.routing.count())
+        # the rules are not changed by loading, so they can be checked again after it
+        routing = Routing()
+        routing.load_from_dicts(rule_list)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rules.snapshot")
+            routing.save_snapshot(path)
+            Routing().load_snapshot(path, rule_list)
+        self.assertNotIn("id", rule_list[2]["customers"]["rules"]["all"][0])
+        # changing a rule changes the digest
+        digest = self.routing.rules_digest
+        self.routing.remove_rule("multiple-jr490u")
+        self.assertNotEqual(self.routing.rules_digest, digest)
+
+    def test_lazy_rules_digest(self):
+        names = ["test_rule_4_multiple_filters", "test_rule_24_routing_history"]
+        rule_list = [load_test_data(name) for name in names]
+        routing = Routing()
+        # the rules are hashed only when the digest is read
+        with unittest.mock.patch.object(Routing, "_digest", wraps=Routing._digest) as digest:
+            routing.load_from_dicts(rule_list, variables={"$WHEELS": ["Superlight"]})
+            routing.load_from_files([os.path.join("test_data", name + ".json") for name in names])
+            routing.remove_rule("multiple-jr490u")
+            self.assertFalse(digest.called)
+            rules_digest = routing.rules_digest
+            self.assertTrue(digest.called)
+        expected = Routing._digest_sections("", Routing._iter_rule_dicts(rule_list), {"$WHEELS": ["Superlight"]})
+        expected = Routing._digest_sections(expected, Routing._iter_rule_dicts(rule_list), None)
+        self.assertEqual(rules_digest, Routing._digest(expected, ["remove", "multiple-jr490u"]))
+        # the digest is computed before pickling
+        routing.upsert_rule("streams", "mountain_bike", {"id": "new", "filters": [{"type": "EXISTS", "key": "frame"}]})
+        self.assertEqual(pickle.loads(pickle.dumps(routing))._digest_sources, [])
+        self.assertEqual(pickle.loads(pickle.dumps(routing)).rules_digest, routing.rules_digest)
+
+    def test_load_from_files(self):
+        names = ["test_rule_4_multiple_filters", "test_rule_24_routing_history", "test_customer_1"]
+        rule_list = [load_test_data(name) for name in names]
+        self.routing.load_from_dicts(copy.deepcopy(rule_list))
+        routing = Routing()
+        with open(os.path.join("test_data", names[2] + ".json"), "rb") as file:
+            routing.load_from_files([os.path.join("test_data", name + ".json") for name in names[:2]] + [file])
+            self.assertFalse(file.closed)
+        # the digest hashes each rule, so the files are parsed into the same rules
+        self.assertEqual(routing.rules_digest, self.routing.rules_digest)
+        self.assertEqual(routing.count(), self.routing.count())
+        for event in (self.test_event_1, self.test_event_2, self.test_event_3):
+            self.assertEqual(routing.match(copy.deepcopy(event)), self.routing.match(copy.deepcopy(event)))
+        # pluggable decoder
+        decoder = unittest.mock.Mock(side_effect=json.loads)
+        Routing().load_from_files([io.BytesIO(json.dumps(rule_list[0]).encode())], decoder=decoder)
+        self.assertTrue(decoder.called)
+        with self.assertRaises(ValueError):
+            Routing().load_from_files([io.BytesIO(b'{"invalid": {"rules": {}}}')])
+        with self.assertRaises(ValueError):
+            Routing().load_from_files([io.BytesIO(b'{"streams": {"rules": {"tag": [{"filters": []}')])
+        # load_from_jsons does not change the list of json data
+        json_list = [json.dumps(rule_file) for rule_file in rule_list]
+        Routing().load_from_jsons(json_list)
+        self.assertEqual(json_list, [json.dumps(rule_file) for rule_file in rule_list])
+
+    def test_rule_file_scanner(self):
+        data = {
+            "streams": {
+                "description": {"text": 'escaped \\" and {[ brackets', "values": [1, 2.5, None, True]},
+                "rules": {
+                    "tag è": [{"id": "a", "filters": [{"type": "EQUALS", "key": "k", "value": ['}\\"]']}], "streams": {"n": -1e3}}, {"id": "b"}],
+                    "empty": [],
+                },
+            },
+            "customers": {"rules": {}},
+        }
+        # a small chunk size splits strings and escapes across reads
+        for chunk_size in (1, 7, READ_CHUNK_SIZE):
+            scanner = RuleFileScanner(io.BytesIO(json.dumps(data, indent=2).encode()), json.loads, chunk_size)
+            sections = [(stream_type, [(tag, list(rules)) for tag, rules in tags]) for stream_type, tags in scanner.sections()]
+            self.assertEqual(sections, [("streams", list(data["streams"]["rules"].items())), ("customers", [])])
+        # unread rules are skipped
+        scanner = RuleFileScanner(io.BytesIO(json.dumps(data).encode()), json.loads, 7)
+        self.assertEqual([stream_type for stream_type, _ in scanner.sections()], ["streams", "customers"])
+
+    def test_match_many(self):
+        self.routing.load_from_dicts(
+            [
+                load_test_data("test_rule_0_all"),
+                load_test_data("test_rule_4_multiple_filters"),
+                load_test_data("test_rule_24_routing_history"),
+                load_test_data("test_rule_29_double_tag"),
+                load_test_data("test_customer_1"),
+            ]
+        )
+        events = [self.test_event_1, self.test_event_2, self.test_event_3, self.test_event_4, self.test_event_18, self.test_event_1]
+        expected_events = copy.deepcopy(events)
+        for type_ in ["streams", "customers"]:
+            expected = [self.routing.match(event, type_=type_) for event in expected_events]
+            self.assertEqual(self.routing.match_many(events, type_=type_), expected)
+        for event, expected_event in zip(events, expected_events):
+            self.assertEqual(event["certego"]["routing_history"].keys(), expected_event["certego"]["routing_history"].keys())
+        self.assertEqual(self.routing.match_many([]), [])
+        with self.assertRaises(ValueError):
+            self.routing.match_many(events, type_="invalid")
+
+    def test_amatch_stream(self):
+        self.routing.load_from_dicts([load_test_data("test_rule_24_routing_history"), load_test_data("test_rule_29_double_tag")])
+        events = [load_test_data(name) for _ in range(3) for name in ["test_event_1", "test_event_2", "test_event_3", "test_event_18"]]
+        expected_events = copy.deepcopy(events)
+        expected = [self.routing.match(event) for event in expected_events]
+
+        async def event_stream():
+            for event in events:
+                await asyncio.sleep(0)
+                yield event
+
+        async def collect(**kwargs):
+            return [res async for res in self.routing.amatch_stream(event_stream(), **kwargs)]
+
+        self.assertEqual(asyncio.run(collect(batch_size=5, max_in_flight=2)), expected)
+        for event, expected_event in zip(events, expected_events):
+            self.assertEqual(event["certego"]["routing_history"].keys(), expected_event["certego"]["routing_history"].keys())
+        with self.assertRaises(ValueError):
+            asyncio.run(collect(type_="invalid"))
+        with self.assertRaises(ValueError):
+            asyncio.run(collect(batch_size=0))
+
+    def test_clock(self):
+        clock = BatchClock()
+        clock.timestamp = unittest.mock.Mock(return_value="2023-06-06T18:00:00")
+        self.routing = Routing(clock=clock)
+        self.routing.load_from_dicts([load_test_data("test_rule_24_routing_history"), load_test_data("test_rule_1_equals")])
+        events = [load_test_data("test_event_1") for _ in range(3)]
+        self.routing.match_many(events)
+        self.assertEqual([event["certego"]["routing_history"] for event in events], [{"Workshop": "2023-06-06T18:00:00"}] * 3)
+        # one timestamp for the whole batch
+        clock.timestamp.assert_called_once()
+        self.routing.match_many(events)
+        self.assertEqual(clock.timestamp.call_count, 2)
+        # no timestamp if no key is written in routing history
+        self.routing.match_many(events)
+        self.assertEqual(clock.timestamp.call_count, 2)
+
+
+class DictQueryTestCase(unittest.TestCase):
+    """Class to test dictquery.py file."""
+
+    def setUp(self):
+        self.event = DictQuery(
+            {
+                "foo.bar": 42,
+                "foo": {"bar": 1, "baz": "hello", "zero": 0},
+                "source": "foobar",
+                "hosts": [{"ip": "1.1.1.1"}, {"name": "test"}, None],
+                "empty": "",
+            }
+        )
+
+    def test_field_path(self):
+        path = FieldPath("foo.baz")
+        self.assertEqual(path.keys, ("foo", "baz"))
+        self.assertTrue(path.dotted)
+        self.assertFalse(FieldPath("foo").dotted)
+        self.assertEqual(path, "foo.baz")
+        self.assertEqual(path, FieldPath("foo.baz"))
+
+    def test_get_field_path(self):
+        paths = ["foo.bar", "foo.baz", "foo.zero", "foo.missing", "foo", "source.ip", "hosts.ip", "hosts.name", "empty", "missing", "missing.key"]
+        for path in paths:
+            for default in [None, []]:
+                self.assertEqual(self.event.get(FieldPath(path), default), self.event.get(path, default), path)
+        self.assertEqual(self.event.get(FieldPath("foo.bar")), 42)
+        self.assertEqual(self.event.get(FieldPath("hosts.ip"), []), ["1.1.1.1", [], None])
+
+    def test_cached_get(self):
+        cached_event = CachedDictQuery(self.event)
+        paths = ["foo.bar", "foo.baz", "foo.zero", "foo.missing", "foo", "source.ip", "hosts.ip", "hosts.name", "empty", "missing", "missing.key"]
+        for _ in range(2):
+            for path in paths:
+                for default in [None, [], "default"]:
+                    self.assertEqual(cached_event.get(FieldPath(path), default), self.event.get(path, default), path)
+        self.assertIn("hosts.ip", cached_event._cache)
+        cached_event["foo"] = {"bar": 2}
+        self.assertEqual(cached_event.get("foo.bar"), 42)
+        self.assertEqual(cached_event.get("foo"), {"bar": 2})
+
+    def test_cached_get_routing_history(self):
+        cached_event = CachedDictQuery({"wheel_model": "Superlight", "certego": {"routing_history": {}}})
+        self.assertFalse(cached_event.get("certego.routing_history.Workshop"))
+        rule = Rule(uid="rule", output={"Workshop": {"workers_needed": 1}})
+        rule.add_filter(filters.EqualFilter("wheel_model", "Superlight"))
+        self.assertTrue(rule.match(cached_event))
+        self.assertTrue(cached_event.get("certego.routing_history.Workshop"))
+        self.assertIsNone(rule.match(cached_event))
+
+
+class ClockTestCase(unittest.TestCase):
+    """Class to test clock.py file."""
+
+    def test_system_clock(self):
+        clock = SystemClock()
+        timestamp = clock.batch()
+        self.assertIsInstance(datetime.datetime.fromisoformat(timestamp()), datetime.datetime)
+        self.assertLessEqual(timestamp(), clock.timestamp())
+
+    def test_batch_clock(self):
+        clock = BatchClock()
+        timestamp = clock.batch()
+        first = timestamp()
+        time.sleep(0.001)
+        self.assertEqual(timestamp(), first)
+        self.assertGreater(clock.batch()(), first)
+
+    def test_coarse_clock(self):
+        clock = CoarseClock(resolution_ms=60000)
+        first = clock.timestamp()
+        time.sleep(0.001)
+        self.assertEqual(clock.timestamp(), first)
+        clock = CoarseClock(resolution_ms=0)
+        first = clock.timestamp()
+        time.sleep(0.001)
+        self.assertGreater(clock.timestamp(), first)
+
+    def test_abstract_clock(self):
+        with self.assertRaises(TypeError):
+            Clock()
+        clock = type("FixedClock", (Clock,), {"timestamp": lambda self: "2024-01-01T00:00:00"})()
+        self.assertEqual(clock.batch()(), "2024-01-01T00:00:00")
+
+
+class StatsTestCase(unittest.TestCase):
+    """Class to test stats.py file."""
+
+    def setUp(self):
+        # a few frequent names among many names seen once
+        self.names = [f"frequent-{i % 5}" if i % 2 else f"rare-{i}" for i in range(10000)]
+
+    def test_exact_stats(self):
+        stats = ExactStats()
+        for name in self.names:
+            stats.add(name)
+        stats.merge({"frequent-1": 10})
+        self.assertEqual(stats.get()["frequent-1"], 1010)
+        self.assertEqual(len(stats.get(delete=True)), 5005)
+        self.assertDictEqual(stats.get(), {})
+
+    def test_top_k_stats(self):
+        stats = TopKStats(k=20)
+        for name in self.names:
+            stats.add(name)
+        hits = stats.get()
+        self.assertEqual(len(hits), 20)
+        # the frequent names are kept, with an upper bound of their hits
+        for i in range(5):
+            self.assertGreaterEqual(hits[f"frequent-{i}"], 1000)
+        self.assertEqual(sum(hits.values()), len(self.names))
+        stats.merge({"new": 10000})
+        self.assertEqual(stats.get()["new"], 10000 + min(hits.values()))
+        self.assertEqual(len(stats.get(delete=True)), 20)
+        self.assertDictEqual(stats.get(), {})
+        with self.assertRaises(ValueError):
+            TopKStats(k=0)
+
+    def test_count_min_stats(self):
+        stats = CountMinStats(width=256, depth=4, heavy_hitters=5)
+        for name in self.names:
+            stats.add(name)
+        hits = stats.get()
+        self.assertSetEqual(set(hits), {f"frequent-{i}" for i in range(5)})
+        for name_hits in hits.values():
+            self.assertGreaterEqual(name_hits, 1000)
+        # the estimates are upper bounds: the counters of a name are also increased by the names colliding with it
+        stats.merge({"frequent-0": 10})
+        self.assertGreaterEqual(stats.get()["frequent-0"], hits["frequent-0"] + 10)
+        stats.get(delete=True)
+        self.assertDictEqual(stats.get(), {})
+        with self.assertRaises(ValueError):
+            CountMinStats(width=0)
+
+    def test_abstract_stats(self):
+        class NameStats(Stats):
+            def add(self, name: str, hits: int = 1) -> None:
+                pass
+
+        # backends without every method fail when they are created, not when they are used
+        with self.assertRaises(TypeError):
+            NameStats()
+        with self.assertRaises(TypeError):
+            Stats()
+
+    def test_count_min_stats_skewed(self):
+        stats = CountMinStats(width=1024, depth=4, heavy_hitters=10)
+        # names arriving in growing order of hits: the heavy hitters change on most hits
+        exact = {}
+        for i in range(50):
+            for _ in range(i + 1):
+                stats.add(f"name-{i}")
+                exact[f"name-{i}"] = exact.get(f"name-{i}", 0) + 1
+        hits = stats.get()
+        self.assertSetEqual(set(hits), {f"name-{i}" for i in range(40, 50)})
+        for name, name_hits in hits.items():
+            self.assertGreaterEqual(name_hits, exact[name])
+        # a single heap entry for each heavy hitter
+        self.assertSetEqual({name for _, name in stats._heavy_heap}, set(hits))
+        self.assertEqual(len(stats._heavy_heap), len(hits))
+
+    def test_total_stats(self):
+        stats = TotalStats()
+        self.assertDictEqual(stats.get(), {})
+        for name in self.names:
+            stats.add(name)
+        stats.merge({"a": 2, "b": 3})
+        self.assertDictEqual(stats.get(delete=True), {TOTAL_KEY: len(self.names) + 5})
+        self.assertDictEqual(stats.get(), {})
+
+
+class AhoCorasickTestCase(unittest.TestCase):
+    """Class to test automaton.py file."""
+
+    def test_search(self):
+        automaton = AhoCorasick([("he", 1), ("she", 2), ("his", 3), ("hers", 4)])
+        self.assertSetEqual(automaton.search("ushers"), {1, 2, 4})
+        self.assertSetEqual(automaton.search("this"), {3})
+        self.assertSetEqual(automaton.search("nothing"), set())
+        self.assertTrue(automaton.contains_any("ushers"))
+        self.assertFalse(automaton.contains_any("nothing"))
+
+    def test_empty_keyword(self):
+        automaton = AhoCorasick([("", 1), ("abc", 2)])
+        self.assertSetEqual(automaton.search(""), {1})
+        self.assertSetEqual(automaton.search("xabcx"), {1, 2})
+        self.assertTrue(automaton.contains_any("x"))
+
+
+class TrieTestCase(unittest.TestCase):
+    """Class to test the Trie in automaton.py file."""
+
+    def test_match_prefix(self):
+        trie = Trie(["/api/", "/static/", "/api/v1/"])
+        self.assertTrue(trie.match_prefix("/api/v1/users"))
+        self.assertTrue(trie.match_prefix("/static/"))
+        self.assertFalse(trie.match_prefix("/api"))
+        self.assertFalse(trie.match_prefix("/admin"))
+        self.assertTrue(Trie([""]).match_prefix(""))
+        self.assertFalse(Trie([]).match_prefix("/api/"))
+
+
+class CompiledRoutingTestCase(RoutingTestCase):
+    """Run all the routing tests again with rules compiled into a single match function."""
+
+    def setUp(self):
+        super().setUp()
+        self.routing.load_from_dicts = functools.partial(self.routing.load_from_dicts, compile_rules=True)
+
+    def test_rules_are_compiled(self):
+        self.routing.load_from_dicts([load_test_data("test_rule_4_multiple_filters")])
+        rule = self.routing.streams._ruleManagers["mountain_bike"]._rules[0]
+        self.assertIsNotNone(rule._compiled)
+        self.assertTrue(rule._compiled(DictQuery(self.test_event_1)))
+        self.assertFalse(rule._compiled(DictQuery(self.test_event_3)))
+        rule.add_filter(filters.AllFilter())
+        self.assertIsNone(rule._compiled)
+
+    def test_pickle_compiled_rules(self):
+        self.routing.load_from_dicts([load_test_data("test_rule_4_multiple_filters")])
+        routing = pickle.loads(pickle.dumps(self.routing))
+        rule = routing.streams._ruleManagers["mountain_bike"]._rules[0]
+        self.assertIsNotNone(rule._compiled)
+        self.assertEqual(routing.match(self.test_event_1)[0].rules, "multiple-jr490u")
+
+
+class ParallelRoutingTestCase(unittest.TestCase):
+    """Class to test parallel.py file, comparing ParallelRouting with Routing."""
+
+    def setUp(self):
+        rule_list = [
+            load_test_data("test_rule_0_all"),
+            load_test_data("test_rule_4_multiple_filters"),
+            load_test_data("test_rule_24_routing_history"),
+            load_test_data("test_rule_29_double_tag"),
+            load_test_data("test_customer_1"),
+        ]
+        # loading gives random ids to the rules without id, so both routings get the same ids here
+        for position, rule in enumerate(
+            rule for rule_file in rule_list for stream in rule_file.values() for rules in stream["rules"].values() for rule in rules
+        ):
+            rule.setdefault("id", f"parallel-{position}")
+        self.routing = Routing()
+        self.routing.load_from_dicts(rule_list, compile_rules=True)
+        self.expected_routing = Routing()
+        self.expected_routing.load_from_dicts(rule_list, compile_rules=True)
+        names = ["test_event_1", "test_event_2", "test_event_3", "test_event_4", "test_event_18", "test_event_with_list_1"]
+        self.events = [load_test_data(name) for _ in range(4) for name in names]
+
+    def check_parallel_routing(self, **kwargs):
+        # stats collected before the workers start must not be counted twice
+        self.routing.match(copy.deepcopy(self.events[0]))
+        self.expected_routing.match(copy.deepcopy(self.events[0]))
+        expected_events = copy.deepcopy(self.events)
+        with ParallelRouting(self.routing, **kwargs) as parallel_routing:
+            for type_ in ["streams", "customers"]:
+                expected = [self.expected_routing.match(event, type_=type_) for event in expected_events]
+                self.assertEqual(parallel_routing.match_many(self.events, type_=type_), expected)
+            self.assertEqual(parallel_routing.match_many([]), [])
+            with self.assertRaises(ValueError):
+                parallel_routing.match_many(self.events, type_="invalid")
+        for event, expected_event in zip(self.events, expected_events):
+            self.assertEqual(event["certego"]["routing_history"].keys(), expected_event["certego"]["routing_history"].keys())
+        self.assertDictEqual(self.routing.get_stats(), self.expected_routing.get_stats())
+
+    def test_match_many(self):
+        self.check_parallel_routing(workers=2, chunk_size=5)
+
+    def test_match_many_spawn(self):
+        self.check_parallel_routing(workers=1, start_method="spawn")
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(ValueError):
+            ParallelRouting(self.routing, chunk_size=0)
+
+
+class CommandLineTestCase(unittest.TestCase):
+    """Class to test __main__.py file, routing NDJSON files from the command line."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.directory.name, "events.ndjson")
+        self.output = os.path.join(self.directory.name, "results.ndjson")
+        events = [load_test_data("test_event_1"), load_test_data("test_event_2"), load_test_data("test_event_3")] * 3
+        with open(self.input, "w") as file:
+            file.write("\n".join(json.dumps(event) for event in events) + "\n\ninvalid\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_output(self):
+        with open(self.output) as file:
+            return [json.loads(line) for line in file]
+
+    def test_main(self):
+        rule_file = os.path.join("test_data", "test_rule_4_multiple_filters.json")
+        expected = {"output": {"Workshop": {"workers_needed": 1}}, "rules": "multiple-jr490u"}
+        with self.assertLogs("routingfilter", level="INFO") as logs, unittest.mock.patch("logging.basicConfig") as basic_config:
+            self.assertEqual(routingfilter_main([rule_file, "-i", self.input, "-o", self.output, "--batch-size", "2"]), 0)
+        self.assertEqual(self.read_output(), [expected] * 3)
+        # the invalid line is logged, and the summary is shown with the default logging configuration
+        self.assertEqual([record.getMessage() for record in logs.records][-1], "3 events matched")
+        self.assertTrue(logs.records[0].getMessage().startswith("Invalid event at line 11: "))
+        self.assertEqual(basic_config.call_args.kwargs["level"], logging.INFO)
+        with self.assertLogs("routingfilter", level="ERROR"):
+            self.assertEqual(routingfilter_main([rule_file, "-i", self.input, "-o", self.output, "--workers", "2", "--include-events"]), 0)
+        output = self.read_output()
+        self.assertEqual([line["results"] for line in output], [[expected]] * 3)
+        self.assertEqual(output[0]["event"]["wheel_model"], load_test_data("test_event_1")["wheel_model"])
+        self.assertIn("Workshop", output[0]["event"]["certego"]["routing_history"])
+
+    def test_read_events(self):
+        lines = b'{"wheel_model": "Superlight"}\n\n[1]\n'
+        decoder = unittest.mock.Mock(side_effect=json.loads)
+        with self.assertLogs("routingfilter", level="ERROR") as logs:
+            self.assertEqual(list(read_events(io.BytesIO(lines), decoder)), [{"wheel_model": "Superlight"}])
+        self.assertEqual(decoder.call_count, 2)
+        self.assertEqual(logs.records[0].getMessage(), "Invalid event at line 3: it is not a json object")
+        # the fastest decoder installed by default
+        with unittest.mock.patch("routingfilter.__main__.get_decoder", return_value=decoder):
+            with self.assertLogs("routingfilter", level="ERROR"):
+                self.assertEqual(list(read_events(io.BytesIO(lines))), [{"wheel_model": "Superlight"}])
+        self.assertEqual(decoder.call_count, 4)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            routingfilter_main([os.path.join("test_data", "test_rule_4_multiple_filters.json"), "--workers", "0"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,186 @@
+import argparse
+import json
+import logging
+import sys
+from itertools import islice
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, List, Optional, TextIO
+
+from .filters.results import Results
+from .loader import get_decoder
+from .parallel import ParallelRouting
+from .routing import Routing
+
+logger = logging.getLogger("routingfilter")
+
+# size of the buffers of input and output files
+IO_BUFFER_SIZE = 1 << 20
+
+
+def read_events(file: BinaryIO, decoder: Optional[Callable[[bytes], Any]] = None) -> Iterator[dict]:
+    """
+    Read NDJSON events from a binary file, one at a time. Empty lines are skipped, invalid lines are logged and skipped.
+
+    :param file: NDJSON file
+    :type file: BinaryIO
+    :param decoder: function decoding the json bytes of an event (default get_decoder(), see routingfilter.loader)
+    :type decoder: Optional[Callable[[bytes], Any]]
+    :return: events
+    :rtype: Iterator[dict]
+    """
+    decoder = decoder or get_decoder()
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            event = decoder(line)
+        except ValueError as e:
+            logger.error(f"Invalid event at line {line_number}: {e}")
+            continue
+        if not isinstance(event, dict):
+            logger.error(f"Invalid event at line {line_number}: it is not a json object")
+            continue
+        yield event
+
+
+def batched(events: Iterable[dict], batch_size: int) -> Iterator[List[dict]]:
+    """
+    Group events in lists of batch_size events (the last one can be shorter).
+
+    :param events: events to group
+    :type events: Iterable[dict]
+    :param batch_size: number of events in a batch
+    :type batch_size: int
+    :return: batches of events
+    :rtype: Iterator[List[dict]]
+    """
+    events = iter(events)
+    while batch := list(islice(events, batch_size)):
+        yield batch
+
+
+def format_results(events: List[dict], results: List[List[Results]], include_events: bool) -> Iterator[str]:
+    """
+    Return an NDJSON line for each matched Results or, if include_events is True, for each matched event with its Results.
+
+    :param events: batch of events
+    :type events: List[dict]
+    :param results: results of each event
+    :type results: List[List[Results]]
+    :param include_events: if True, write the event with its results
+    :type include_events: bool
+    :return: NDJSON lines
+    :rtype: Iterator[str]
+    """
+    for event, event_results in zip(events, results):
+        if not event_results:
+            continue
+        if include_events:
+            yield json.dumps({"event": event, "results": [res.to_dict() for res in event_results]}) + "\n"
+        else:
+            for res in event_results:
+                yield json.dumps(res.to_dict()) + "\n"
+
+
+def route(routing: Routing | ParallelRouting, events: Iterable[dict], output: TextIO, batch_size: int, include_events: bool = False, **kwargs) -> int:
+    """
+    Match events in batches and write the results of each batch to output with a single write.
+
+    :param routing: routing used to match the events
+    :type routing: Routing | ParallelRouting
+    :param events: events to match
+    :type events: Iterable[dict]
+    :param output: NDJSON output file
+    :type output: TextIO
+    :param batch_size: number of events matched at a time
+    :type batch_size: int
+    :param include_events: if True, write the events with their results
+    :type include_events: bool
+    :param kwargs: other arguments of match_many (type_ and tag_field_name)
+    :type kwargs: dict
+    :return: number of matched events
+    :rtype: int
+    """
+    matched = 0
+    for batch in batched(events, batch_size):
+        results = routing.match_many(batch, **kwargs)
+        matched += sum(1 for event_results in results if event_results)
+        output.write("".join(format_results(batch, results, include_events)))
+    return matched
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parse the command line arguments.
+
+    :param argv: command line arguments (default sys.argv)
+    :type argv: Optional[List[str]]
+    :return: parsed arguments
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(prog="routingfilter", description="Match NDJSON events against routing rules and write the results as NDJSON.")
+    parser.add_argument("rules", nargs="+", help="json rule files")
+    parser.add_argument("-i", "--input", default="-", help="NDJSON event file (default stdin)")
+    parser.add_argument("-o", "--output", default="-", help="NDJSON result file (default stdout)")
+    parser.add_argument("--variables", help="json file with the variables of the rules")
+    parser.add_argument("--type", dest="type_", choices=["streams", "customers"], default="streams", help="stream type (default streams)")
+    parser.add_argument("--tag-field", dest="tag_field_name", default="tags", help="event field with the tags (default tags)")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default 1, no pool)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="number of events matched at a time (default 1000)")
+    parser.add_argument("--compile-rules", action="store_true", help="compile each rule into a single match function")
+    parser.add_argument("--reorder-filters", action="store_true", help="check the cheapest filters of each rule first")
+    parser.add_argument("--include-events", action="store_true", help="write each matched event with its results instead of the results only")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be a positive integer")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be a positive integer")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Entry point of the command line: load the rules and route the events of the input file to the output file.
+
+    :param argv: command line arguments (default sys.argv)
+    :type argv: Optional[List[str]]
+    :return: exit code
+    :rtype: int
+    """
+    # the summary is logged at INFO level, on stderr like the errors
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    args = parse_args(argv)
+    variables = None
+    if args.variables:
+        with open(args.variables) as file:
+            variables = json.load(file)
+    routing = Routing()
+    routing.load_from_files(args.rules, variables=variables, compile_rules=args.compile_rules, reorder_filters=args.reorder_filters)
+
+    input_file = sys.stdin.buffer if args.input == "-" else open(args.input, "rb", buffering=IO_BUFFER_SIZE)
+    output_file = sys.stdout if args.output == "-" else open(args.output, "w", buffering=IO_BUFFER_SIZE)
+    parallel_routing = ParallelRouting(routing, workers=args.workers, chunk_size=-(-args.batch_size // args.workers)) if args.workers > 1 else None
+    try:
+        matched = route(
+            parallel_routing or routing,
+            read_events(input_file),
+            output_file,
+            args.batch_size,
+            include_events=args.include_events,
+            type_=args.type_,
+            tag_field_name=args.tag_field_name,
+        )
+    finally:
+        if parallel_routing:
+            parallel_routing.close()
+        if input_file is not sys.stdin.buffer:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+        else:
+            output_file.flush()
+    logger.info(f"{matched} events matched")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable
+
+
+class Clock(ABC):
+    """Source of the timestamps written in the routing history of the events.
+
+    Routing calls batch once for each call of match (or match_many) and the returned function each time a key is added
+    to the routing history, so that the timestamps are formatted only when they are needed.
+    """
+
+    @abstractmethod
+    def timestamp(self) -> str:
+        """
+        Return the current timestamp in ISO format.
+
+        :return: timestamp
+        :rtype: str
+        """
+        return NotImplemented
+
+    def batch(self) -> Callable[[], str]:
+        """
+        Return the function that gives the timestamps for a batch of events.
+
+        :return: function returning a timestamp in ISO format
+        :rtype: Callable[[], str]
+        """
+        return self.timestamp
+
+
+class SystemClock(Clock):
+    """Clock that reads the system time on each call. It is the default clock of Routing."""
+
+    def timestamp(self) -> str:
+        """
+        Return the current timestamp in ISO format.
+
+        :return: timestamp
+        :rtype: str
+        """
+        return datetime.now().isoformat()
+
+
+class BatchClock(SystemClock):
+    """Clock that reads the system time once for each batch: all the events of a call of match_many get the same
+    timestamp, taken the first time it is needed."""
+
+    def batch(self) -> Callable[[], str]:
+        """
+        Return a function that reads the system time on its first call and then returns always the same timestamp.
+
+        :return: function returning a timestamp in ISO format
+        :rtype: Callable[[], str]
+        """
+        timestamp = None
+
+        def batch_timestamp() -> str:
+            nonlocal timestamp
+            if timestamp is None:
+                timestamp = self.timestamp()
+            return timestamp
+
+        return batch_timestamp
+
+
+class CoarseClock(SystemClock):
+    """Clock that reads the system time at most once every resolution_ms milliseconds, returning the same
+    timestamp in the meantime."""
+
+    def __init__(self, resolution_ms: float = 10):
+        self.resolution = resolution_ms / 1000
+        self._expiry = 0.0
+        self._timestamp = None
+
+    def timestamp(self) -> str:
+        """
+        Return the cached timestamp in ISO format, reading the system time again if it is older than the resolution.
+
+        :return: timestamp
+        :rtype: str
+        """
+        now = time.monotonic()
+        if now >= self._expiry:
+            self._timestamp = super().timestamp()
+            self._expiry = now + self.resolution
+        return self._timestamp
@@ -1,3 +1,48 @@
+from datetime import datetime
+
+
+class _Missing:
+    """Falsy placeholder returned by DictQuery.get when a path is not found."""
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+class FieldPath:
+    """
+    Precompiled path for DictQuery.get: the path is split on ``.`` only once, when the object is created,
+    so that looking it up in an event does not require any string operation.
+    """
+
+    __slots__ = ("path", "keys", "dotted")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.keys = tuple(path.split("."))
+        # a path without dots is resolved with a single dictionary lookup
+        self.dotted = len(self.keys) > 1
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return f"FieldPath({self.path!r})"
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __eq__(self, other):
+        if isinstance(other, FieldPath):
+            return self.path == other.path
+        return self.path == other
+
+
 class DictQuery(dict):
     # https://www.haykranen.nl/2016/02/13/handling-complex-nested-dicts-in-python/
 
@@ -22,17 +67,36 @@ class DictQuery(dict):
 
 
         :param path: path to match
-        :type path: string
+        :type path: string | FieldPath
         :param default: default return value, defaults to None
         :type default: obj, optional
         :return: matched values or None
         :rtype: obj
         """
+        if type(path) is FieldPath:
+            if not path.dotted:
+                return dict.get(self, path.path, default)
+            value = dict.get(self, path.path)
+            if value:
+                return value
+            return self._walk(path.keys, default)
+
         value = dict.get(self, path)
         if value:
             return value
+        return self._walk(path.split("."), default)
 
-        keys = path.split(".")
+    def _walk(self, keys, default=None):
+        """
+        Walk the dictionary following the keys of a path.
+
+        :param keys: keys of the path to match
+        :type keys: Sequence[str]
+        :param default: default return value, defaults to None
+        :type default: obj, optional
+        :return: matched values or None
+        :rtype: obj
+        """
         value = None
 
         try:
@@ -66,3 +130,151 @@ class DictQuery(dict):
             key = keys.pop()
             tmp = {key: tmp}
         self.update(tmp)
+
+    def invalidate(self, path):
+        """
+        Notify that the value of path was changed in place. DictQuery does not cache anything, so it does nothing.
+
+        :param path: changed path
+        :type path: string | FieldPath
+        """
+
+    def timestamp(self):
+        """
+        Return the timestamp to write in the routing history, read from the system time.
+
+        :return: timestamp in ISO format
+        :rtype: str
+        """
+        return datetime.now().isoformat()
+
+    def memoize(self, key, function):
+        """
+        Return the result of function called on this dictionary. DictQuery does not cache anything, so it is computed on each call.
+
+        :param key: key identifying the result
+        :type key: Hashable
+        :param function: function to call with the dictionary as argument
+        :type function: Callable[[DictQuery], obj]
+        :return: result of function
+        :rtype: obj
+        """
+        return function(self)
+
+
+class _PartialList(list):
+    """List of values resolved from a list of dictionaries, where some of them did not contain the key."""
+
+
+class CachedDictQuery(DictQuery):
+    """DictQuery that resolves each path only once and then returns the cached value.
+
+    It is meant to wrap an event for the duration of a single match: every filter of every rule looking up the same
+    path shares the same lookup. Values changed in place (e.g. the routing history) must be notified with invalidate.
+
+    ::
+
+        event = CachedDictQuery({"source": {"ip": "1.1.1.1"}})
+        event.get("source.ip")  # walks the dictionary
+        event.get("source.ip")  # returns the cached value
+    """
+
+    def __init__(self, *args, timestamp=None, **kwargs):
+        """
+        :param timestamp: function returning the timestamp to write in the routing history (see routingfilter.clock)
+        :type timestamp: Callable[[], str], optional
+        """
+        super().__init__(*args, **kwargs)
+        self._cache = {}
+        self._memo = {}
+        if timestamp is not None:
+            self.timestamp = timestamp
+
+    def get(self, path, default=None):
+        """Return the value of the path, resolving it only the first time it is requested.
+
+        Values are cached without their default: when the path is missing, MISSING is stored and replaced by the
+        default given to each call. Truthy defaults change the way the path is walked, so they are not cached.
+
+        :param path: path to match
+        :type path: string | FieldPath
+        :param default: default return value, defaults to None
+        :type default: obj, optional
+        :return: matched values or None
+        :rtype: obj
+        """
+        if default:
+            return DictQuery.get(self, path, default)
+        cache_key = path.path if type(path) is FieldPath else path
+        try:
+            value = self._cache[cache_key]
+        except KeyError:
+            value = DictQuery.get(self, path, MISSING)
+            # walking a list of dictionaries puts the default in place of the missing keys
+            if type(value) is list and MISSING in value:
+                value = _PartialList(value)
+            self._cache[cache_key] = value
+        if value is MISSING:
+            return default
+        if type(value) is _PartialList:
+            return [default if v is MISSING else v for v in value]
+        return value
+
+    def memoize(self, key, function):
+        """
+        Return the result of function called on this dictionary, computing it only the first time key is requested.
+        Memoized results are discarded when the dictionary changes.
+
+        :param key: key identifying the result
+        :type key: Hashable
+        :param function: function to call with the dictionary as argument
+        :type function: Callable[[DictQuery], obj]
+        :return: result of function
+        :rtype: obj
+        """
+        try:
+            return self._memo[key]
+        except KeyError:
+            result = self._memo[key] = function(self)
+            return result
+
+    def invalidate(self, path):
+        """
+        Remove from the cache the values of path and of its sub-paths, and all the memoized results.
+
+        :param path: changed path
+        :type path: string | FieldPath
+        """
+        path = str(path)
+        prefix = path + "."
+        for cached in [cached for cached in self._cache if isinstance(cached, str) and (cached == path or cached.startswith(prefix))]:
+            del self._cache[cached]
+        self._memo.clear()
+
+    def _clear_cache(self):
+        self._cache.clear()
+        self._memo.clear()
+
+    def __setitem__(self, key, value):
+        self._clear_cache()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._clear_cache()
+        super().__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        self._clear_cache()
+        super().update(*args, **kwargs)
+
+    def pop(self, *args):
+        self._clear_cache()
+        return super().pop(*args)
+
+    def setdefault(self, key, default=None):
+        self._clear_cache()
+        return super().setdefault(key, default)
+
+    def clear(self):
+        self._clear_cache()
+        super().clear()
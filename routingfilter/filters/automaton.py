@@ -0,0 +1,155 @@
+from collections import deque
+from typing import Hashable, Iterable, Set, Tuple
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton to search many keywords in a string with a single scan.
+
+    Each keyword is added with a label: search returns the labels of all the keywords contained in a string,
+    contains_any stops at the first one found.
+
+    ::
+
+        automaton = AhoCorasick([("he", 1), ("she", 2), ("hers", 3)])
+        automaton.search("ushers")  # returns {1, 2, 3}
+        automaton.contains_any("history")  # returns False
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, Hashable]]):
+        # states are array-backed: goto transitions, failure links and output labels of the state with index i
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        for keyword, label in keywords:
+            self._add(keyword, label)
+        self._build()
+
+    def _add(self, keyword: str, label: Hashable) -> None:
+        """
+        Add a keyword to the trie of the automaton.
+
+        :param keyword: keyword to search
+        :type keyword: str
+        :param label: value returned by search when the keyword is found
+        :type label: Hashable
+        :return: no value
+        :rtype: None
+        """
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+            state = next_state
+        self._output[state].add(label)
+
+    def _build(self) -> None:
+        """
+        Compute the failure links with a breadth-first visit of the trie and merge the outputs of each state with the ones of its failure state.
+
+        :return: no value
+        :rtype: None
+        """
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._output[next_state] |= self._output[fail]
+        # the empty keyword is contained in every string
+        for state in range(1, len(self._output)):
+            self._output[state] |= self._output[0]
+        self._output = [frozenset(output) for output in self._output]
+
+    def search(self, text: str) -> Set[Hashable]:
+        """
+        Return the labels of all the keywords contained in text.
+
+        :param text: string to scan
+        :type text: str
+        :return: labels of the keywords found
+        :rtype: Set[Hashable]
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set(output[0])
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+    def contains_any(self, text: str) -> bool:
+        """
+        Return True if at least one keyword is contained in text.
+
+        :param text: string to scan
+        :type text: str
+        :return: true or false
+        :rtype: bool
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        if output[0]:
+            return True
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                return True
+        return False
+
+
+class Trie:
+    """Character trie to check if a string starts with one of many prefixes, with cost bounded by the string length.
+
+    ::
+
+        trie = Trie(["/api/", "/static/"])
+        trie.match_prefix("/api/v1/users")  # returns True
+        trie.match_prefix("/admin")  # returns False
+    """
+
+    # key of the nodes where a prefix ends: it cannot clash with a character
+    _END = ""
+
+    def __init__(self, prefixes: Iterable[str]):
+        self._root = {}
+        for prefix in prefixes:
+            node = self._root
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[self._END] = True
+
+    def match_prefix(self, text: str) -> bool:
+        """
+        Return True if at least one prefix of the trie is a prefix of text.
+
+        :param text: string to check
+        :type text: str
+        :return: true or false
+        :rtype: bool
+        """
+        end = self._END
+        node = self._root
+        if end in node:
+            return True
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                return False
+            if end in node:
+                return True
+        return False
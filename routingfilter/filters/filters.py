@@ -1,18 +1,86 @@
+import bisect
+import functools
 import logging
+import operator
 import re
 from abc import ABC, abstractmethod
-from typing import NoReturn, Optional
+from typing import Callable, Dict, Hashable, List, NoReturn, Optional, Set, Tuple
 
 import macaddress
 from IPy import IP
-from routingfilter.dictquery import DictQuery
+from routingfilter.dictquery import DictQuery, FieldPath
+
+from .automaton import AhoCorasick, Trie
+
+# minimum number of keywords of a KEYWORD filter to search them with an automaton instead of one by one
+KEYWORD_AUTOMATON_THRESHOLD = 100
+# minimum number of prefixes (suffixes) of a STARTSWITH (ENDSWITH) filter to check them with a trie instead of one by one
+AFFIX_TRIE_THRESHOLD = 32
+# number of event IP addresses whose parsing is cached by NETWORK filters
+IP_CACHE_SIZE = 65536
+
+logger = logging.getLogger(__name__)
+
+
+# FieldPath objects and tuples of keys are shared by all the filters with the same keys
+_field_path = functools.lru_cache(maxsize=None)(FieldPath)
+_key_tuple = functools.lru_cache(maxsize=None)(tuple)
+
+
+class SharedValues:
+    """Values of the filters using the same variables. The values are checked (and normalized) once for each filter class,
+    and all the filters of the class share the checked values and the structures built from them (e.g. sets, tries).
+    """
+
+    __slots__ = ("values", "_checked")
+
+    def __init__(self, values: List):
+        """
+        :param values: values of the variables
+        :type values: List
+        """
+        self.values = tuple(values)
+        self._checked: Dict[type, tuple] = {}
+
+    def check(self, new_filter: "AbstractFilter") -> None:
+        """
+        Set the checked values of new_filter, calling its _check_value only for the first filter of its class.
+        An exception is raised if the values are invalid for the filter.
+
+        :param new_filter: filter being initialized
+        :type new_filter: AbstractFilter
+        :return: no value
+        :rtype: None
+        """
+        filter_class = new_filter.__class__
+        checked = self._checked.get(filter_class)
+        if checked is None:
+            new_filter._value = list(self.values)
+            new_filter._check_value()
+            checked = self._checked[filter_class] = tuple(getattr(new_filter, slot) for slot in filter_class.CHECKED_SLOTS)
+        else:
+            for slot, value in zip(filter_class.CHECKED_SLOTS, checked):
+                setattr(new_filter, slot, value)
 
 
 class AbstractFilter(ABC):
+    __slots__ = ("_key", "_value", "_shared")
+    # cost class of the match method, from 0 (constant time) to 7 (regular expressions): see cost
+    COST = 0
+    # False for the negated filters, which match the events without their keys: see required_keys
+    REQUIRES_KEY = True
+    # attributes set by _check_value, which filters with the same SharedValues share
+    CHECKED_SLOTS: Tuple[str, ...] = ("_value",)
+
     def __init__(self, key, value, **kwargs):
-        self._key = key if isinstance(key, list) else [key]
+        key = key if isinstance(key, list) else [key]
+        self._key = _key_tuple(tuple(_field_path(k) if isinstance(k, str) else k for k in key))
+        # True if the filter is used by more than one rule: its result is memoized in the event (see Rule.match)
+        self._shared = False
+        if isinstance(value, SharedValues):
+            value.check(self)
+            return
         self._value = value if isinstance(value, list) else [value]
-        self.logger = logging.getLogger(self.__class__.__name__)
         self._check_value()
 
     @abstractmethod
@@ -29,14 +97,111 @@ class AbstractFilter(ABC):
         """
         return NotImplemented
 
+    def signature(self) -> Hashable:
+        """
+        Return a value identifying what the filter checks: filters with the same signature always give the same result,
+        so a single instance can be used in place of all of them. _check_value stores the values in a hashable form
+        (e.g. a tuple or a frozenset), otherwise the filter is never interned (see Routing._intern_filter).
+
+        :return: type, keys and normalized values of the filter
+        :rtype: Hashable
+        """
+        return self.__class__, self._key, self._value
+
+    def required_keys(self) -> Tuple[FieldPath, ...]:
+        """
+        Return the keys needed by the filter: it cannot match an event that contains none of them, i.e. where looking
+        them up returns MISSING (see Rule.required_keys). Negated filters need no key.
+
+        :return: keys of the filter, or an empty tuple
+        :rtype: Tuple[FieldPath, ...]
+        """
+        return self._key if self.REQUIRES_KEY else ()
+
+    def cost(self) -> int:
+        """
+        Return the cost class of the filter, used to check the cheapest filters of a rule first (see Rule.reorder_filters).
+
+        :return: cost class, higher for more expensive filters
+        :rtype: int
+        """
+        return self.COST
+
+    def compile(self) -> Callable[[DictQuery], bool]:
+        """
+        Return a function equivalent to the match method, specialized for this filter: keys and values are bound as
+        constants so that no attribute lookup or method dispatch is needed at match time.
+
+        :return: function that takes an event and returns true or false
+        :rtype: Callable[[DictQuery], bool]
+        """
+        return self.match
+
+    def _compile_values(self, check: Callable[[str], bool], to_str: bool = True) -> Callable[[DictQuery], bool]:
+        """
+        Build a function returning True if check is true for at least one event value of one of the keys.
+
+        :param check: function to call on each event value
+        :type check: Callable[[str], bool]
+        :param to_str: if true, event values are converted to string before calling check
+        :type to_str: bool
+        :return: function that takes an event and returns true or false
+        :rtype: Callable[[DictQuery], bool]
+        """
+        matchers = [self._compile_key(key, check, to_str) for key in self._key]
+        if len(matchers) == 1:
+            return matchers[0]
+        return lambda event: any(match_key(event) for match_key in matchers)
+
+    @staticmethod
+    def _compile_key(key: FieldPath, check: Callable[[str], bool], to_str: bool) -> Callable[[DictQuery], bool]:
+        """
+        Build a function returning True if check is true for at least one event value of the key.
+
+        :param key: key to search into the event
+        :type key: FieldPath
+        :param check: function to call on each event value
+        :type check: Callable[[str], bool]
+        :param to_str: if true, event values are converted to string before calling check
+        :type to_str: bool
+        :return: function that takes an event and returns true or false
+        :rtype: Callable[[DictQuery], bool]
+        """
+        if to_str:
+
+            def match_key(event: DictQuery) -> bool:
+                event_value = event.get(key, [])
+                if not isinstance(event_value, list):
+                    return check(str(event_value))
+                for value in event_value:
+                    if check(str(value)):
+                        return True
+                return False
+
+        else:
+
+            def match_key(event: DictQuery) -> bool:
+                event_value = event.get(key, [])
+                if not isinstance(event_value, list):
+                    return check(event_value)
+                for value in event_value:
+                    if check(value):
+                        return True
+                return False
+
+        return match_key
+
 
 class AllFilter(AbstractFilter):
+    __slots__ = ()
+    COST = 0
+
     def __init__(self):
         key = value = []
         super().__init__(key, value)
 
     def _check_value(self) -> Exception | NoReturn:
-        return
+        self._value = ()
 
     def match(self, event: DictQuery) -> bool:
         """
@@ -49,14 +214,20 @@ class AllFilter(AbstractFilter):
         """
         return True
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        return lambda event: True
+
 
 class ExistFilter(AbstractFilter):
+    __slots__ = ()
+    COST = 1
+
     def __init__(self, key):
         value = []
         super().__init__(key, value)
 
     def _check_value(self) -> Exception | NoReturn:
-        return
+        self._value = ()
 
     def match(self, event: DictQuery) -> bool:
         """
@@ -72,8 +243,18 @@ class ExistFilter(AbstractFilter):
                 return True
         return False
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        keys = self._key
+        if len(keys) == 1:
+            key = keys[0]
+            return lambda event: event.get(key) is not None
+        return lambda event: any(event.get(key) is not None for key in keys)
+
 
 class NotExistFilter(ExistFilter):
+    __slots__ = ()
+    REQUIRES_KEY = False
+
     def match(self, event: DictQuery) -> bool:
         """
         Return True if no key exists in the event.
@@ -85,17 +266,21 @@ class NotExistFilter(ExistFilter):
         """
         return not ExistFilter.match(self, event)
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        exists = ExistFilter.compile(self)
+        return lambda event: not exists(event)
+
 
 class EqualFilter(AbstractFilter):
+    __slots__ = ()
+    COST = 2
+
     def __init__(self, key, value):
         super().__init__(key, value)
 
     def _check_value(self) -> Exception | NoReturn:
-        tmp = []
-        for value in self._value:
-            value = str(value).lower()
-            tmp.append(value)
-        self._value = tmp
+        # a set, so that each event value is looked up in constant time
+        self._value = frozenset(str(value).lower() for value in self._value)
 
     def match(self, event: DictQuery):
         """
@@ -115,8 +300,15 @@ class EqualFilter(AbstractFilter):
                     return True
         return False
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        values = self._value
+        return self._compile_values(lambda value: value.lower() in values)
+
 
 class NotEqualFilter(EqualFilter):
+    __slots__ = ()
+    REQUIRES_KEY = False
+
     def match(self, event: DictQuery) -> bool:
         """
         Return True if no value is equal to ones corresponding to the event keys.
@@ -128,14 +320,23 @@ class NotEqualFilter(EqualFilter):
         """
         return not EqualFilter.match(self, event)
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        equals = EqualFilter.compile(self)
+        return lambda event: not equals(event)
+
 
 class StartswithFilter(AbstractFilter):
+    __slots__ = ("_trie",)
+    COST = 4
+    CHECKED_SLOTS = ("_value", "_trie")
+
     def _check_value(self) -> Exception | NoReturn:
         tmp = []
         for prefix in self._value:
             prefix = str(prefix).lower()
             tmp.append(prefix)
-        self._value = tmp
+        self._value = tuple(tmp)
+        self._trie = Trie(tmp) if len(tmp) >= AFFIX_TRIE_THRESHOLD else None
 
     def match(self, event: DictQuery) -> bool:
         """
@@ -154,6 +355,9 @@ class StartswithFilter(AbstractFilter):
                     return True
         return False
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        return self._compile_values(self._check_startswith)
+
     def _check_startswith(self, value: str) -> bool:
         """
         Check if the value starts with one of the prefix given.
@@ -164,19 +368,24 @@ class StartswithFilter(AbstractFilter):
         :rtype: bool
         """
         value = value.lower()
-        for prefix in self._value:
-            if value.startswith(prefix):
-                return True
-        return False
+        if self._trie is not None:
+            return self._trie.match_prefix(value)
+        return value.startswith(self._value)
 
 
 class EndswithFilter(AbstractFilter):
+    __slots__ = ("_trie",)
+    COST = 4
+    CHECKED_SLOTS = ("_value", "_trie")
+
     def _check_value(self) -> Exception | NoReturn:
         tmp = []
         for suffix in self._value:
             suffix = str(suffix).lower()
             tmp.append(suffix)
-        self._value = tmp
+        self._value = tuple(tmp)
+        # suffixes are stored reversed, so that the trie checks the end of the value
+        self._trie = Trie(suffix[::-1] for suffix in tmp) if len(tmp) >= AFFIX_TRIE_THRESHOLD else None
 
     def match(self, event: DictQuery) -> bool:
         """
@@ -195,6 +404,9 @@ class EndswithFilter(AbstractFilter):
                     return True
         return False
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        return self._compile_values(self._check_endswith)
+
     def _check_endswith(self, value: str) -> bool:
         """
         Check if the value end with one of the suffix given.
@@ -205,19 +417,28 @@ class EndswithFilter(AbstractFilter):
         :rtype: bool
         """
         value = value.lower()
-        for suffix in self._value:
-            if value.endswith(suffix):
-                return True
-        return False
+        if self._trie is not None:
+            return self._trie.match_prefix(value[::-1])
+        return value.endswith(self._value)
 
 
 class KeywordFilter(AbstractFilter):
+    __slots__ = ("_automaton", "_group", "_slot")
+    COST = 6
+    CHECKED_SLOTS = ("_value", "_automaton")
+
+    def __init__(self, key, value):
+        self._group = None
+        self._slot = None
+        super().__init__(key, value)
+
     def _check_value(self) -> Exception | NoReturn:
         tmp = []
         for keyword in self._value:
             keyword = str(keyword).lower()
             tmp.append(keyword)
-        self._value = tmp
+        self._value = tuple(tmp)
+        self._automaton = AhoCorasick((keyword, None) for keyword in tmp) if len(tmp) >= KEYWORD_AUTOMATON_THRESHOLD else None
 
     def match(self, event: DictQuery) -> bool:
         """
@@ -228,6 +449,8 @@ class KeywordFilter(AbstractFilter):
         :return: true or false
         :rtype: bool
         """
+        if self._group is not None:
+            return self._slot in event.memoize(self._group, self._group.search)
         for key in self._key:
             event_value = event.get(key, [])
             event_value = event_value if isinstance(event_value, list) else [event_value]
@@ -236,6 +459,12 @@ class KeywordFilter(AbstractFilter):
                     return True
         return False
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        if self._group is not None:
+            group, slot = self._group, self._slot
+            return lambda event: slot in event.memoize(group, group.search)
+        return self._compile_values(self._check_keyword)
+
     def _check_keyword(self, value: str) -> bool:
         """
         Check if keyword is contained in value.
@@ -246,16 +475,72 @@ class KeywordFilter(AbstractFilter):
         :rtype: bool
         """
         value = value.lower()
+        if self._automaton is not None:
+            return self._automaton.contains_any(value)
         for keyword in self._value:
-            if keyword in value.lower():
+            if keyword in value:
                 return True
         return False
 
+    def share(self, group: "KeywordGroup | None", slot: int | None = None) -> None:
+        """
+        Check the keywords with the automaton of a group instead of the filter one. If group is None, stop sharing.
+
+        :param group: group of the filter
+        :type group: KeywordGroup | None
+        :param slot: label of the filter keywords in the group automaton
+        :type slot: int | None
+        :return: no value
+        :rtype: None
+        """
+        self._group = group
+        self._slot = slot
+
+
+class KeywordGroup:
+    """KEYWORD filters with the same keys, whose keywords are searched in the event with a single automaton scan.
+
+    The labels found for an event are memoized in the event, so each filter just checks if its label is among them.
+    """
+
+    def __init__(self, keyword_filters: List[KeywordFilter]):
+        self._key = keyword_filters[0]._key
+        self._automaton = AhoCorasick((keyword, slot) for slot, keyword_filter in enumerate(keyword_filters) for keyword in keyword_filter._value)
+        for slot, keyword_filter in enumerate(keyword_filters):
+            keyword_filter.share(self, slot)
+
+    def search(self, event: DictQuery) -> Set[int]:
+        """
+        Return the labels of the filters having at least one keyword contained in an event value of the keys.
+
+        :param event: event to filter
+        :type event: DictQuery
+        :return: labels of the matching filters
+        :rtype: Set[int]
+        """
+        found = set()
+        for key in self._key:
+            event_value = event.get(key, [])
+            event_value = event_value if isinstance(event_value, list) else [event_value]
+            for value in event_value:
+                found |= self._automaton.search(str(value).lower())
+        return found
+
 
 class RegexpFilter(AbstractFilter):
+    __slots__ = ("_fused", "_unfused", "_fused_pattern", "_group", "_slot")
+    COST = 7
+    CHECKED_SLOTS = ("_value", "_fused", "_unfused", "_fused_pattern")
+
+    def __init__(self, key, value):
+        self._group = None
+        self._slot = None
+        super().__init__(key, value)
+
     def _check_value(self) -> Exception | NoReturn:
         """
         Check if values in self._value are valid regexes.
+        The regexes that can be combined are fused into a single alternation, so that a value is scanned only once.
 
         :return: none or error generated:
         :rtype: Optional[Exception]
@@ -265,9 +550,22 @@ class RegexpFilter(AbstractFilter):
             try:
                 tmp.append(re.compile(value))
             except re.error as e:
-                self.logger.error(f"Invalid regex {value}, during check of value list {self._value}. Error message: {e}")
+                logger.error(f"Invalid regex {value}, during check of value list {self._value}. Error message: {e}")
                 raise ValueError(f"Regex check failed: error for value {value}. Error message: {e}")
-        self._value = tmp
+        self._value = tuple(tmp)
+        fusible = [regex.pattern for regex in tmp if _is_fusible(regex)]
+        self._unfused = tuple(regex for regex in tmp if not _is_fusible(regex))
+        self._fused_pattern = "|".join(f"(?:{pattern})" for pattern in fusible) if fusible else None
+        self._fused = None
+        if len(fusible) == 1:
+            self._fused = next(regex for regex in tmp if _is_fusible(regex))
+        elif fusible:
+            try:
+                self._fused = re.compile(self._fused_pattern)
+            except re.error as e:
+                logger.debug(f"Impossible to fuse regexes {fusible}, they are checked one by one. Error message: {e}")
+                self._fused_pattern = None
+                self._unfused = tuple(tmp)
 
     def match(self, event: DictQuery) -> bool:
         """
@@ -278,6 +576,8 @@ class RegexpFilter(AbstractFilter):
         :return: true or false
         :rtype: bool
         """
+        if self._group is not None:
+            return self._match_group(event)
         for key in self._key:
             event_value = event.get(key, [])
             event_value = event_value if isinstance(event_value, list) else [event_value]
@@ -286,6 +586,11 @@ class RegexpFilter(AbstractFilter):
                     return True
         return False
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        if self._group is not None:
+            return self._match_group
+        return self._compile_values(self._check_regex)
+
     def _check_regex(self, value: str) -> bool:
         """
         Check if at least one regex matches the value.
@@ -295,13 +600,129 @@ class RegexpFilter(AbstractFilter):
         :return: true or false
         :rtype: bool
         """
-        for regex in self._value:
+        if self._fused is not None and self._fused.search(value):
+            return True
+        for regex in self._unfused:
             if regex.search(value):
                 return True
         return False
 
+    def _check_unfused(self, value: str) -> bool:
+        """
+        Check if at least one of the regexes that cannot be fused matches the value.
+
+        :param value: value to check
+        :type value: str
+        :return: true or false
+        :rtype: bool
+        """
+        for regex in self._unfused:
+            if regex.search(value):
+                return True
+        return False
+
+    def _match_group(self, event: DictQuery) -> bool:
+        """
+        Match the event using the result of the group search: if no fused regex of the group matched, only the regexes
+        that cannot be fused are checked. If the filter regexes matched, the result is known without any further search.
+
+        :param event: event to filter
+        :type event: DictQuery
+        :return: true or false
+        :rtype: bool
+        """
+        found, slots = event.memoize(self._group, self._group.search)
+        if self._slot in slots:
+            return True
+        if not found and not self._unfused:
+            return False
+        check = self._check_regex if found else self._check_unfused
+        for key in self._key:
+            event_value = event.get(key, [])
+            event_value = event_value if isinstance(event_value, list) else [event_value]
+            for value in event_value:
+                if check(str(value)):
+                    return True
+        return False
+
+    def share(self, group: "RegexpGroup | None", slot: int | None = None) -> None:
+        """
+        Check the fused regexes with the ones of a group. If group is None, stop sharing.
+
+        :param group: group of the filter
+        :type group: RegexpGroup | None
+        :param slot: name of the group of the filter regexes in the fused regex
+        :type slot: str | None
+        :return: no value
+        :rtype: None
+        """
+        self._group = group
+        self._slot = slot
+
+
+# regexes using groups numbers or names, or setting global flags, cannot be part of an alternation
+_UNFUSIBLE_REGEX = re.compile(r"\\[1-9]|\\g<|\(\?P=|\(\?\(|^\(\?[aiLmsux]+\)")
+
+
+def _is_fusible(regex: re.Pattern) -> bool:
+    """
+    Return True if the regex can be combined with other ones in a single alternation without changing its meaning.
+
+    :param regex: regex to check
+    :type regex: re.Pattern
+    :return: true or false
+    :rtype: bool
+    """
+    return isinstance(regex.pattern, str) and not regex.groupindex and regex.flags == re.UNICODE and not _UNFUSIBLE_REGEX.search(regex.pattern)
+
+
+class RegexpGroup:
+    """REGEXP filters with the same keys, whose fused regexes are combined in a single regex with a named group for each filter.
+
+    A single search tells whether no filter matches or which filter matched first: the other filters must be checked
+    only if the search found something.
+    Named groups prevent the regex engine from optimizing common literal prefixes, so values are first searched with
+    the same alternation without names, and the named one is used only to find the filter of a match.
+    """
+
+    def __init__(self, regexp_filters: List[RegexpFilter]):
+        self._key = regexp_filters[0]._key
+        self._any_regex = re.compile("|".join(f"(?:{regexp_filter._fused_pattern})" for regexp_filter in regexp_filters))
+        self._regex = re.compile("|".join(f"(?P<r{slot}>{regexp_filter._fused_pattern})" for slot, regexp_filter in enumerate(regexp_filters)))
+        for slot, regexp_filter in enumerate(regexp_filters):
+            regexp_filter.share(self, f"r{slot}")
+
+    def search(self, event: DictQuery) -> Tuple[bool, Set[str]]:
+        """
+        Search the combined regex in the event values of the keys.
+
+        :param event: event to filter
+        :type event: DictQuery
+        :return: true if at least a regex matched, and the names of the groups that matched
+        :rtype: Tuple[bool, Set[str]]
+        """
+        found = False
+        slots = set()
+        for key in self._key:
+            event_value = event.get(key, [])
+            event_value = event_value if isinstance(event_value, list) else [event_value]
+            for value in event_value:
+                value = str(value)
+                if self._any_regex.search(value):
+                    found = True
+                    slots.add(self._regex.search(value).lastgroup)
+        return found, slots
+
+
+# position of the intervals of each IP version in NetworkFilter._intervals
+_IP_VERSIONS = {4: 0, 6: 1}
+
 
 class NetworkFilter(AbstractFilter):
+    __slots__ = ("_intervals",)
+    COST = 5
+    CHECKED_SLOTS = ("_value", "_intervals")
+
     def __init__(self, key, value):
         super().__init__(key, value)
 
@@ -317,13 +738,36 @@ class NetworkFilter(AbstractFilter):
             try:
                 value = IP(value)
             except ValueError as e:
-                self.logger.error(f"IP address (value error) error, during check of value {value} in list {self._value}. Error was: {e}.")
+                logger.error(f"IP address (value error) error, during check of value {value} in list {self._value}. Error was: {e}.")
                 raise ValueError(f"IP address check failed: value error for value {value}.")
             except TypeError as e:
-                self.logger.error(f"IP address (type error) error, during check of value {value} in list {self._value}. Error was: {e}.")
+                logger.error(f"IP address (type error) error, during check of value {value} in list {self._value}. Error was: {e}.")
                 raise ValueError(f"IP address check failed: type error for value {value}.")
             tmp.append(value)
-        self._value = tmp
+        self._value = tuple(tmp)
+        self._intervals = self._get_intervals(tmp)
+
+    @staticmethod
+    def _get_intervals(networks: List[IP]) -> Tuple[Tuple[Tuple[int, ...], Tuple[int, ...]] | None, ...]:
+        """
+        Convert the networks into sorted and disjoint intervals of integers for each IP version.
+        Networks are either disjoint or nested, so only the ones not contained in another network are kept.
+
+        :param networks: networks to convert
+        :type networks: List[IP]
+        :return: for IPv4 and IPv6 (see _IP_VERSIONS), the interval starts and the interval ends or None
+        :rtype: Tuple[Tuple[Tuple[int, ...], Tuple[int, ...]] | None, ...]
+        """
+        intervals = {}
+        for network in sorted(networks, key=lambda n: (n.version(), n.int(), -n.len())):
+            start = network.int()
+            end = start + network.len() - 1
+            starts, ends = intervals.setdefault(network.version(), ([], []))
+            if ends and start <= ends[-1]:
+                continue
+            starts.append(start)
+            ends.append(end)
+        return tuple((tuple(intervals[version][0]), tuple(intervals[version][1])) if version in intervals else None for version in _IP_VERSIONS)
 
     def match(self, event: DictQuery) -> bool:
         """
@@ -342,28 +786,58 @@ class NetworkFilter(AbstractFilter):
                     return True
         return False
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        return self._compile_values(self._check_network)
+
     def _check_network(self, ip_address: str) -> bool:
         """
         Check if IP address matches one of the value. If it is not valid IP address, return False.
+        The address (or network) matches if its interval of integers is inside one of the value intervals.
 
         :param ip_address: IP address to check
         :type ip_address: str
         :return: true or false
         :rtype: bool
         """
-        try:
-            ip_address = IP(ip_address)
-            for value in self._value:
-                if ip_address in value:
-                    return True
-        except ValueError as e:
-            self.logger.debug(f"Error in parsing IP address (value error): {e}. ")
-        except TypeError as e:
-            self.logger.debug(f"Error in parsing IP address (type error): {e}. ")
-        return False
+        parsed = _parse_ip(ip_address)
+        if parsed is None:
+            return False
+        version, start, end = parsed
+        intervals = self._intervals[_IP_VERSIONS[version]]
+        if intervals is None:
+            return False
+        starts, ends = intervals
+        position = bisect.bisect_right(starts, start) - 1
+        return position >= 0 and end <= ends[position]
+
+
+@functools.lru_cache(maxsize=IP_CACHE_SIZE)
+def _parse_ip(ip_address: str) -> Tuple[int, int, int] | None:
+    """
+    Parse an IP address or network and return its version and its first and last address as integers.
+    Return None if it is not a valid IP address.
+
+    :param ip_address: IP address to parse
+    :type ip_address: str
+    :return: version, first address and last address or None
+    :rtype: Tuple[int, int, int] | None
+    """
+    try:
+        ip_address = IP(ip_address)
+    except ValueError as e:
+        logger.debug(f"Error in parsing IP address (value error): {e}. ")
+        return None
+    except TypeError as e:
+        logger.debug(f"Error in parsing IP address (type error): {e}. ")
+        return None
+    start = ip_address.int()
+    return ip_address.version(), start, start + ip_address.len() - 1
 
 
 class NotNetworkFilter(NetworkFilter):
+    __slots__ = ()
+    REQUIRES_KEY = False
+
     def match(self, event: DictQuery) -> bool:
         """
         Return True if at least no event IP address matches the value one.
@@ -375,8 +849,15 @@ class NotNetworkFilter(NetworkFilter):
         """
         return not NetworkFilter.match(self, event)
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        network = NetworkFilter.compile(self)
+        return lambda event: not network(event)
+
 
 class DomainFilter(AbstractFilter):
+    __slots__ = ()
+    COST = 4
+
     def __init__(self, key, value):
         super().__init__(key, value)
 
@@ -393,7 +874,7 @@ class DomainFilter(AbstractFilter):
                 raise ValueError(f"Domain check failed: value {domain} is not a string.")
             domain = str(domain).lower()
             tmp.append(domain)
-        self._value = tmp
+        self._value = tuple(tmp)
 
     def match(self, event: DictQuery) -> bool:
         """
@@ -412,6 +893,9 @@ class DomainFilter(AbstractFilter):
                     return True
         return False
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        return self._compile_values(self._check_domain)
+
     def _check_domain(self, value: str) -> bool:
         """
         Check if value is equal to or ends with one of domains.
@@ -427,7 +911,13 @@ class DomainFilter(AbstractFilter):
         return False
 
 
+_COMPARATORS = {"GREATER": operator.gt, "LESS": operator.lt, "GREATER_EQ": operator.ge, "LESS_EQ": operator.le}
+
+
 class ComparatorFilter(AbstractFilter):
+    __slots__ = ("_comparator_type",)
+    COST = 3
+
     def __init__(self, key, value, comparator_type):
         self._comparator_type = comparator_type
         self._check_comparator_type()
@@ -445,9 +935,12 @@ class ComparatorFilter(AbstractFilter):
             try:
                 tmp.append(float(value))
             except ValueError:
-                self.logger.error(f"Comparator check failed: value {value} of list {self._value} is not a float")
+                logger.error(f"Comparator check failed: value {value} of list {self._value} is not a float")
                 raise ValueError(f"Comparator check failed: value {value} is not a float")
-        self._value = tmp
+        self._value = tuple(tmp)
+
+    def signature(self) -> Hashable:
+        return self.__class__, self._key, self._value, self._comparator_type
 
     def _check_comparator_type(self) -> Exception | NoReturn:
         """
@@ -457,7 +950,7 @@ class ComparatorFilter(AbstractFilter):
         :rtype: Exception | NoReturn
         """
         if self._comparator_type not in ["GREATER", "LESS", "GREATER_EQ", "LESS_EQ"]:
-            self.logger.error(f"Comparator check failed: value {self._comparator_type} is not valid.")
+            logger.error(f"Comparator check failed: value {self._comparator_type} is not valid.")
             raise ValueError(f"Comparator type check failed. {self._comparator_type} is not a valid comparator.")
 
     def match(self, event: DictQuery) -> bool:
@@ -489,8 +982,8 @@ class ComparatorFilter(AbstractFilter):
         for term in self._value:
             try:
                 value = float(value)
-            except ValueError as e:
-                self.logger.debug(f"Error in parsing value to float in comparator filter: {e}. ")
+            except (TypeError, ValueError) as e:
+                logger.debug(f"Error in parsing value to float in comparator filter: {e}. ")
                 return False
             match self._comparator_type:
                 case "GREATER":
@@ -507,8 +1000,33 @@ class ComparatorFilter(AbstractFilter):
                         return True
         return False
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        if not self._value:
+            return lambda event: False
+        terms = self._value
+        compare = _COMPARATORS[self._comparator_type]
+
+        def check(value: any) -> bool:
+            try:
+                value = float(value)
+            except (TypeError, ValueError) as e:
+                logger.debug(f"Error in parsing value to float in comparator filter: {e}. ")
+                return False
+            for term in terms:
+                if compare(value, term):
+                    return True
+            return False
+
+        return self._compile_values(check, to_str=False)
+
+
+_TYPES = {"str": str, "int": int, "float": float, "bool": bool, "list": list, "dict": dict}
+
 
 class TypeofFilter(AbstractFilter):
+    __slots__ = ()
+    COST = 3
+
     def __init__(self, key, value):
         super().__init__(key, value)
 
@@ -524,10 +1042,21 @@ class TypeofFilter(AbstractFilter):
         for value in self._value:
             value = str(value).lower()
             if value not in valid_type:
-                self.logger.error(f"Type check failed: value {value} of list {self._value} is invalid.")
+                logger.error(f"Type check failed: value {value} of list {self._value} is invalid.")
                 raise ValueError(f"Type check failed: value {value} is invalid.")
             tmp.append(value)
-        self._value = tmp
+        self._value = tuple(tmp)
+
+    def cost(self) -> int:
+        """
+        Return the cost class of the filter: checking ip and mac types means parsing the values, as a REGEXP filter.
+
+        :return: cost class
+        :rtype: int
+        """
+        if "ip" in self._value or "mac" in self._value:
+            return RegexpFilter.COST
+        return self.COST
 
     def match(self, event: DictQuery) -> bool:
         """
@@ -545,6 +1074,38 @@ class TypeofFilter(AbstractFilter):
                     return True
         return False
 
+    def compile(self) -> Callable[[DictQuery], bool]:
+        keys = self._key
+        checks = tuple(self._type_check(val_type) for val_type in self._value)
+
+        def match_type(event: DictQuery) -> bool:
+            for key in keys:
+                value = event.get(key)
+                for check in checks:
+                    if check(value):
+                        return True
+            return False
+
+        return match_type
+
+    def _type_check(self, val_type: str) -> Callable[[any], bool]:
+        """
+        Return the function checking a value against the given type.
+
+        :param val_type: type
+        :type val_type: str
+        :return: function that takes a value and returns true or false
+        :rtype: Callable[[any], bool]
+        """
+        if val_type == "ip":
+            return self._check_ip
+        elif val_type == "mac":
+            return self._check_mac
+        elif val_type in _TYPES:
+            type_ = _TYPES[val_type]
+            return lambda value: type(value) is type_
+        return lambda value: False
+
     def _check_type(self, value: any, val_type: str) -> bool:
         """
         Check type of the value.
@@ -586,7 +1147,7 @@ class TypeofFilter(AbstractFilter):
         try:
             if isinstance(value, int) or int(value):
                 return False
-        except ValueError:
+        except (TypeError, ValueError):
             try:
                 IP(value)
                 return True
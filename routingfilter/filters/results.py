@@ -1,14 +1,69 @@
+import copy
 from dataclasses import dataclass
 
+from routingfilter.dictquery import DictQuery
 
-@dataclass
+
+def _copy_output(value):
+    """
+    Deep copy of a rule output. Outputs are json data, so dictionaries and lists are copied with a simple recursion,
+    which is much faster than copy.deepcopy; other mutable values fall back to copy.deepcopy.
+
+    :param value: value to copy
+    :type value: any
+    :return: the copy
+    :rtype: any
+    """
+    if isinstance(value, dict):
+        copied = {key: _copy_output(item) for key, item in value.items()}
+        return DictQuery(copied) if isinstance(value, DictQuery) else copied
+    if isinstance(value, list):
+        return [_copy_output(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return copy.deepcopy(value)
+
+
+class _SharedOutput:
+    """Output of a rule shared by its results, wrapped so that Results.output copies it at the first access."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+@dataclass(slots=True, init=False)
 class Results:
+    """Rules and output of a match.
+
+    If shared is True, output belongs to the rule and it is shared by all its results: it is copied only when the
+    output attribute is accessed for the first time, so that callers can modify it.
+    """
+
     rules: str
     output: dict
 
-    def __init__(self, rules, output):
+    def __init__(self, rules, output, shared: bool = False):
         self.rules = rules
-        self.output = output["customer"] if output is not None and "customer" in output.keys() else output
+        output = output["customer"] if output is not None and "customer" in output.keys() else output
+        self.output = _SharedOutput(output) if shared and output is not None else output
 
     def to_dict(self):
         return {"output": self.output, "rules": self.rules}
+
+
+# the output slot is wrapped by a property copying the shared outputs, which is used by the methods generated by
+# dataclass too (e.g. __eq__, __repr__ and dataclasses.asdict)
+_output_slot = Results.output
+
+
+def _get_output(results: Results):
+    output = _output_slot.__get__(results)
+    if output.__class__ is _SharedOutput:
+        output = _copy_output(output.value)
+        _output_slot.__set__(results, output)
+    return output
+
+
+Results.output = property(_get_output, _output_slot.__set__)
@@ -1,26 +1,61 @@
-import copy
-import logging
-from datetime import datetime
-from typing import List
+import bisect
+import functools
+import heapq
+import itertools
+from collections import Counter
+from typing import Callable, List, Optional
 
-from routingfilter.dictquery import DictQuery
+from routingfilter.dictquery import MISSING, DictQuery, FieldPath
+from routingfilter.stats import ExactStats, Stats
 
-from .filters import AbstractFilter
+from .filters import AbstractFilter, EqualFilter, KeywordFilter, KeywordGroup, RegexpFilter, RegexpGroup
 from .results import Results
 
+# outputs with at most this number of keys are computed in advance for every subset of keys in routing history
+OUTPUT_SUBSETS_MAX_KEYS = 4
+
+ROUTING_HISTORY = FieldPath("certego.routing_history")
+
+# a filter rejection rate is used to reorder the filters only after the filter has been checked this number of times
+FILTER_OBSERVATIONS_MIN = 100
+
+# number of keys, the ones required by more rules, that RuleManager looks up in each event to skip the rules requiring missing keys
+PRECHECK_MAX_KEYS = 64
+
+# EQUALS filters with more values are not indexed by RuleManager: their values are a set, checked in constant time, and
+# indexing them would add an entry for each value (e.g. large variables shared by many rules)
+EQUALS_INDEX_MAX_VALUES = 1024
+
+# sets of output keys are shared by all the rules with the same keys
+_key_set = functools.lru_cache(maxsize=None)(frozenset)
+RULE_NAME = FieldPath("rule.name")
+
 
 class Rule:
-    def __init__(self, uid, output):
+    __slots__ = ("uid", "output", "_stats", "_filters", "_compiled", "_output_keys", "_outputs", "_observations")
+
+    def __init__(self, uid, output, stats: Optional[Stats] = None):
+        """
+        :param uid: rule id
+        :type uid: str
+        :param output: output of the rule
+        :type output: dict | None
+        :param stats: stats of the rule hits (default ExactStats, see routingfilter.stats)
+        :type stats: Optional[Stats]
+        """
         self.uid = uid
         self.output = DictQuery(output) if output else None
-        self._stats = {}
-        self._filters = []
-        self.logger = logging.getLogger(self.__class__.__name__)
+        self._stats = stats if stats is not None else ExactStats()
+        self._filters = ()
+        self._compiled = None
+        # [checks, rejections] of each filter, collected only if observe_filters is enabled
+        self._observations = None
+        self._prepare_outputs()
 
     def match(self, event: DictQuery) -> Results | None:
         """
         Call match method for each filter. If all filters match, the output is returned, None otherwise. If the filter
-        matches, the output key with current timestamp in ISO format is added to certego.routing_history field of the event.
+        matches, the output key with the timestamp of the event (see DictQuery.timestamp) is added to certego.routing_history field of the event.
         The match is added also to stats. If "certego.routing_history" already contains the output key value, the filter must not match and None is returned.
 
         :param event: event to check
@@ -28,44 +63,161 @@ class Rule:
         :return: the output or no value
         :rtype: Results | None
         """
-        for f in self._filters:
-            if not f.match(event):
+        if self._observations is not None:
+            if not self._match_observed(event):
                 return None
-        now = datetime.now().isoformat()
-        # check if output keys are in certego.routing_history keys
-        if self.output and set(self.output.keys()) <= set(event.get("certego.routing_history").keys()):
-            return None
-        # add stats
-        event_id = event.get("rule.name", "unknown")
-        self._add_stats(event_id)
+        elif self._compiled is not None:
+            if not self._compiled(event):
+                return None
+        else:
+            for f in self._filters:
+                # filters shared with other rules are checked once per event
+                if not (event.memoize(f, f.match) if f._shared else f.match(event)):
+                    return None
         # if output is None
         if not self.output:
+            self._add_stats(event.get(RULE_NAME, "unknown"))
             return Results(rules=self.uid, output=None)
-        # if at least one output key is not in certego.routing_history keys, it is added to certego.routing_history keys and delete from output keys
-        output_copy = copy.deepcopy(self.output)
+        # check if output keys are in certego.routing_history keys
+        routing_history = event.get(ROUTING_HISTORY)
+        routed_keys = self._output_keys.intersection(routing_history.keys())
+        if len(routed_keys) == len(self._output_keys):
+            return None
+        # add stats
+        self._add_stats(event.get(RULE_NAME, "unknown"))
+        # the output keys not in certego.routing_history keys are added to them, the others are deleted from the output
+        now = None
         for key in self.output.keys():
-            routing_history = event.get("certego.routing_history")
-            if key in routing_history:
-                output_copy.pop(key)
-            else:
-                if key != "customer":
-                    routing_history.update({key: now})
-        results = Results(rules=self.uid, output=output_copy)
-        return results
+            if key not in routed_keys and key != "customer":
+                # the timestamp is built only if a key is written
+                if now is None:
+                    now = event.timestamp()
+                routing_history[key] = now
+        event.invalidate(ROUTING_HISTORY)
+        return Results(rules=self.uid, output=self._get_output(frozenset(routed_keys)), shared=True)
+
+    def _match_observed(self, event: DictQuery) -> bool:
+        """
+        Check the filters as match does, counting for each filter how many times it is checked and how many times it rejects the event.
+
+        :param event: event to check
+        :type event: DictQuery
+        :return: true if all the filters match
+        :rtype: bool
+        """
+        for f, observations in zip(self._filters, self._observations):
+            observations[0] += 1
+            if not (event.memoize(f, f.match) if f._shared else f.match(event)):
+                observations[1] += 1
+                return False
+        return True
+
+    def required_keys(self) -> frozenset:
+        """
+        Return the keys that an event must contain for the rule to match: the key of each filter requiring a single key
+        (see AbstractFilter.required_keys). Filters with more keys require only one of them, so they are not considered.
+
+        :return: required keys
+        :rtype: frozenset
+        """
+        keys = (f.required_keys() for f in self._filters)
+        return _key_set(tuple(filter_keys[0] for filter_keys in keys if len(filter_keys) == 1))
+
+    def observe_filters(self, enable: bool = True) -> None:
+        """
+        Start (or stop, if enable is False) counting the events rejected by each filter, so that reorder_filters can use the
+        observed rejection rates. Counting makes match slower, so it should be enabled only for a sample of the traffic.
+
+        :param enable: if True, count the rejections, otherwise stop counting and discard the counters
+        :type enable: bool
+        :return: no value
+        :rtype: None
+        """
+        if not enable:
+            self._observations = None
+        elif self._observations is None:
+            self._observations = [[0, 0] for _ in self._filters]
+
+    def reorder_filters(self, observed: bool = False) -> None:
+        """
+        Sort the filters so that the cheapest ones are checked first: filters are ANDed, so the order does not change the result.
+        Filters are sorted by cost class (see AbstractFilter.cost), keeping the original order for equal costs.
+        If observed is True and observe_filters is enabled, filters are sorted by cost divided by the observed rejection rate,
+        so that cheap filters rejecting most events come first. Filters checked less than FILTER_OBSERVATIONS_MIN times are
+        assumed to reject half of the events. After an observed reordering the counters are reset, since the new order changes them.
+
+        :param observed: if True, use the rejection rates observed by match
+        :type observed: bool
+        :return: no value
+        :rtype: None
+        """
+        observations = self._observations if observed else None
+
+        def sort_key(position: int) -> tuple:
+            cost = self._filters[position].cost()
+            if observations is None:
+                return cost
+            checks, rejections = observations[position]
+            rejection_rate = rejections / checks if checks >= FILTER_OBSERVATIONS_MIN else 0.5
+            # filters that never reject go last, cheapest first
+            return (cost + 1) / rejection_rate if rejection_rate else float("inf"), cost
+
+        order = sorted(range(len(self._filters)), key=sort_key)
+        self._filters = tuple(self._filters[position] for position in order)
+        if observations is not None:
+            self._observations = [[0, 0] for _ in self._filters]
+        elif self._observations is not None:
+            self._observations = [self._observations[position] for position in order]
+        if self._compiled is not None:
+            self.compile()
+
+    def _get_output(self, routed_keys: frozenset) -> DictQuery:
+        """
+        Return the output without the keys already in routing history. The outputs are computed once for each set of keys
+        and shared by all the results, which copy them only when they are accessed.
+
+        :param routed_keys: output keys already in routing history
+        :type routed_keys: frozenset
+        :return: the output without routed_keys
+        :rtype: DictQuery
+        """
+        if not routed_keys:
+            return self.output
+        output = self._outputs.get(routed_keys)
+        if output is None:
+            output = DictQuery({key: value for key, value in self.output.items() if key not in routed_keys})
+            self._outputs[routed_keys] = output
+        return output
+
+    def _prepare_outputs(self) -> None:
+        """
+        Compute the outputs for every set of keys that routing history can remove (see _get_output). When the output has
+        more than OUTPUT_SUBSETS_MAX_KEYS keys there are too many sets, so they are computed when they are needed.
+        The full output is the rule output itself.
+
+        :return: no value
+        :rtype: None
+        """
+        self._output_keys = _key_set(tuple(self.output.keys())) if self.output else frozenset()
+        # with a single key there is only the full output
+        self._outputs = {} if len(self._output_keys) > 1 else None
+        if len(self._output_keys) > OUTPUT_SUBSETS_MAX_KEYS:
+            return
+        # all the keys routed means no match, so there is no output for them
+        for size in range(1, len(self._output_keys)):
+            for routed_keys in itertools.combinations(self._output_keys, size):
+                self._get_output(_key_set(routed_keys))
 
     def _add_stats(self, event_id: str) -> None:
         """
-        Add to stats a new entry with event_id and number of hits or increment it if the entry already exists.
+        Add a hit of event_id to stats.
 
         :param event_id: id of the event which stats are to add or update
         :type event_id: str
         :return: no value
         :rtype: None
         """
-        if event_id in self._stats.keys():
-            self._stats[event_id] += 1
-        else:
-            self._stats.update({event_id: 1})
+        self._stats.add(event_id)
 
     def get_stats(self, delete=False) -> dict:
         """
@@ -76,10 +228,46 @@ class Rule:
         :return: all stats
         :rtype: dict
         """
-        stats = {str(self.uid): self._stats}
-        if delete:
-            self._stats = {}
-        return stats
+        return {str(self.uid): self._stats.get(delete)}
+
+    def merge_stats(self, stats: dict) -> None:
+        """
+        Add to stats the hits of the rule contained in stats, in the format returned by get_stats (e.g. the stats collected by another process).
+
+        :param stats: stats in format {uid: stats}
+        :type stats: dict
+        :return: no value
+        :rtype: None
+        """
+        self._stats.merge(stats.get(str(self.uid), {}))
+
+    def __getstate__(self) -> dict:
+        """
+        Return the state of the rule to pickle. The compiled match function cannot be pickled, so it is replaced by a flag
+        and generated again when the rule is unpickled.
+
+        :return: state of the rule
+        :rtype: dict
+        """
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state["_compiled"] = self._compiled is not None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        """
+        Restore the state of a pickled rule and compile it again if it was compiled.
+
+        :param state: state returned by __getstate__
+        :type state: dict
+        :return: no value
+        :rtype: None
+        """
+        compiled = state.pop("_compiled")
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._compiled = None
+        if compiled:
+            self.compile()
 
     def add_filter(self, filters: AbstractFilter | List[AbstractFilter]) -> None:
         """
@@ -92,14 +280,69 @@ class Rule:
         """
         if not isinstance(filters, list):
             filters = [filters]
-        self._filters += filters
+        self._filters += tuple(filters)
+        self._compiled = None
+        if self._observations is not None:
+            self._observations.extend([0, 0] for _ in filters)
+
+    def compile(self) -> None:
+        """
+        Generate a single function that checks all the filters of the rule, so that match does not need to loop over
+        them and to call each filter match method. The function is discarded when a filter is added.
+
+        :return: no value
+        :rtype: None
+        """
+        self._compiled = self._generate_match_function([self._compile_filter(f) for f in self._filters])
+
+    @staticmethod
+    def _compile_filter(f: AbstractFilter) -> Callable[[DictQuery], bool]:
+        """
+        Return the compiled function of a filter. If the filter is shared with other rules, its result is memoized in the event.
+
+        :param f: filter to compile
+        :type f: AbstractFilter
+        :return: function that takes an event and returns true or false
+        :rtype: Callable[[DictQuery], bool]
+        """
+        check = f.compile()
+        if not f._shared:
+            return check
+        return lambda event: event.memoize(f, check)
+
+    def _generate_match_function(self, checks: List[Callable[[DictQuery], bool]]) -> Callable[[DictQuery], bool]:
+        """
+        Generate the source code of a function that returns True only if all checks return True and compile it.
+
+        :param checks: functions returned by the filters compile method
+        :type checks: List[Callable[[DictQuery], bool]]
+        :return: function that takes an event and returns true or false
+        :rtype: Callable[[DictQuery], bool]
+        """
+        if not checks:
+            return lambda event: True
+        if len(checks) == 1:
+            return checks[0]
+        namespace = {f"check_{i}": check for i, check in enumerate(checks)}
+        condition = " and ".join(f"check_{i}(event)" for i in range(len(checks)))
+        source = f"def match_rule(event):\n    return {condition}\n"
+        exec(compile(source, f"<rule {self.uid}>", "exec"), namespace)
+        return namespace["match_rule"]
 
 
 class RuleManager:
-    def __init__(self, tag: str):
+    __slots__ = ("tag", "share_keywords", "share_regexps", "_rules", "_index", "_positions", "_removed")
+
+    def __init__(self, tag: str, share_keywords: bool = False, share_regexps: bool = False):
         self.tag = tag
+        self.share_keywords = share_keywords
+        self.share_regexps = share_regexps
         self._rules = []
-        self.logger = logging.getLogger(self.__class__.__name__)
+        self._index = None
+        # position of each rule id, built at the first upsert_rule or remove_rule
+        self._positions = None
+        # number of removed rules: their positions in _rules are None until the rules are compacted
+        self._removed = 0
 
     def count(self) -> int:
         """
@@ -108,7 +351,18 @@ class RuleManager:
         :return: number of rules
         :rtype: int
         """
-        return len(self._rules)
+        return len(self._rules) - self._removed
+
+    def rules(self) -> List[Rule]:
+        """
+        Return the rules in match order.
+
+        :return: rules
+        :rtype: List[Rule]
+        """
+        if self._removed:
+            return [rule for rule in self._rules if rule is not None]
+        return self._rules
 
     def match(self, event: DictQuery, tag: str) -> Results | None:
         """
@@ -124,12 +378,163 @@ class RuleManager:
         """
         if tag != self.tag:
             return None
-        for rule in self._rules:
-            match_rule = rule.match(event)
+        if self._index is None:
+            self.prepare()
+        return self._match(event)
+
+    def match_many(self, events: List[DictQuery], tag: str) -> List[Results | None]:
+        """
+        Call match for each event, checking the tag and preparing the index only once.
+
+        :param events: events to check
+        :type events: List[DictQuery]
+        :param tag: routing tag
+        :type tag: str
+        :return: result of match or None for each event
+        :rtype: List[Results | None]
+        """
+        if tag != self.tag:
+            return [None] * len(events)
+        if self._index is None:
+            self.prepare()
+        match = self._match
+        return [match(event) for event in events]
+
+    def _match(self, event: DictQuery) -> Results | None:
+        """
+        Return the result of the first rule matching the event, checking only the candidates selected by the index.
+
+        :param event: event to check
+        :type event: DictQuery
+        :return: result of match or None
+        :rtype: Results | None
+        """
+        equal_index, scan_positions, precheck_keys, masks = self._index
+        # bits of the required keys missing from the event: the rules requiring them are skipped
+        absent = 0
+        for key, bit in precheck_keys:
+            if event.get(key, MISSING) is MISSING:
+                absent |= bit
+        rules = self._rules
+        positions = heapq.merge(self._get_candidates(event, equal_index), scan_positions) if equal_index else scan_positions
+        for position in positions:
+            if absent and masks[position] & absent:
+                continue
+            match_rule = rules[position].match(event)
             if match_rule:
                 return match_rule
         return None
 
+    def prepare(self) -> None:
+        """
+        Build the inverted index used by match to select the rules to check. Each rule with an EQUALS filter is indexed
+        by the filter keys and values: it can match only if the event contains one of them. The other rules are always checked.
+        Each of the PRECHECK_MAX_KEYS keys required by more rules (see Rule.required_keys) gets a bit, and each rule the mask
+        of the bits of its required keys: match looks up these keys once per event and skips the rules whose keys are missing.
+        If share_keywords is True, KEYWORD filters with the same keys share a single automaton (see KeywordGroup).
+        If share_regexps is True, REGEXP filters with the same keys share a single fused regex (see RegexpGroup).
+        The index is built again at the first match after a rule is added; rules changed with upsert_rule and remove_rule
+        are updated in the index, without building it again.
+
+        :return: no value
+        :rtype: None
+        """
+        self._compact()
+        self._share_filters()
+        equal_index = {}
+        scan_positions = []
+        for position, rule in enumerate(self._rules):
+            equal_filter = self._get_index_filter(rule)
+            if equal_filter is None:
+                scan_positions.append(position)
+                continue
+            for key in equal_filter._key:
+                key_index = equal_index.setdefault(key, {})
+                for value in equal_filter._value:
+                    key_index.setdefault(value, []).append(position)
+        # tuples take less memory than the lists used to build them
+        for key_index in equal_index.values():
+            for value, positions in key_index.items():
+                key_index[value] = tuple(positions)
+        required_keys = [rule.required_keys() for rule in self._rules]
+        key_counts = Counter(key for keys in required_keys for key in keys)
+        key_bits = {key: 1 << bit for bit, (key, _) in enumerate(key_counts.most_common(PRECHECK_MAX_KEYS))}
+        mask_pool = {}
+        masks = []
+        for keys in required_keys:
+            mask = 0
+            for key in keys:
+                mask |= key_bits.get(key, 0)
+            # rules with the same keys share the same int
+            masks.append(mask_pool.setdefault(mask, mask))
+        # scan positions and masks are lists, so that upsert_rule can update them
+        self._index = (equal_index, scan_positions, tuple(key_bits.items()), masks)
+
+    def _share_filters(self) -> None:
+        """
+        Group the KEYWORD and REGEXP filters of the rules by keys and build a KeywordGroup or a RegexpGroup for each group
+        with more than one filter, if sharing is enabled. Compiled rules containing these filters are compiled again.
+
+        :return: no value
+        :rtype: None
+        """
+        groups = {}
+        for rule in self._rules:
+            for f in rule._filters:
+                if type(f) is KeywordFilter or type(f) is RegexpFilter:
+                    f.share(None)
+                    # a dictionary keeps each filter once, even if it is used by many rules
+                    groups.setdefault((type(f), f._key), {})[f] = None
+        for (filter_type, _), shared_filters in groups.items():
+            shared_filters = list(shared_filters)
+            if filter_type is KeywordFilter and self.share_keywords and len(shared_filters) > 1:
+                KeywordGroup(shared_filters)
+            elif filter_type is RegexpFilter and self.share_regexps:
+                shared_filters = [f for f in shared_filters if f._fused_pattern is not None]
+                if len(shared_filters) > 1:
+                    RegexpGroup(shared_filters)
+        for rule in self._rules:
+            if rule._compiled is not None and any(type(f) is KeywordFilter or type(f) is RegexpFilter for f in rule._filters):
+                rule.compile()
+
+    @staticmethod
+    def _get_index_filter(rule: Rule) -> EqualFilter | None:
+        """
+        Return the EQUALS filter with fewer values of the rule, None if the rule has no EQUALS filter or if it has more
+        than EQUALS_INDEX_MAX_VALUES values. Negated filters (e.g. NOT_EQUALS) are never used.
+
+        :param rule: rule to index
+        :type rule: Rule
+        :return: filter to use in the index or None
+        :rtype: EqualFilter | None
+        """
+        equal_filters = [f for f in rule._filters if type(f) is EqualFilter and len(f._value) <= EQUALS_INDEX_MAX_VALUES]
+        if not equal_filters:
+            return None
+        return min(equal_filters, key=lambda f: len(f._value))
+
+    @staticmethod
+    def _get_candidates(event: DictQuery, equal_index: dict) -> List[int]:
+        """
+        Return the sorted positions of the indexed rules whose EQUALS filter can match the event.
+
+        :param event: event to check
+        :type event: DictQuery
+        :param equal_index: inverted index built by prepare
+        :type equal_index: dict
+        :return: rule positions
+        :rtype: List[int]
+        """
+        candidates = set()
+        for key, key_index in equal_index.items():
+            event_value = event.get(key, [])
+            event_value = event_value if isinstance(event_value, list) else [event_value]
+            for value in event_value:
+                positions = key_index.get(str(value).lower())
+                if positions:
+                    candidates.update(positions)
+        return sorted(candidates)
+
     def add_rule(self, rule: Rule | List[Rule]) -> None:
         """
         Add rule or a list of rule to rule list so that sorting by "group_number" and "rule_number" is maintained.
@@ -142,7 +547,168 @@ class RuleManager:
         if not isinstance(rule, list):
             rule = [rule]
         for r in rule:
+            if self._positions is not None:
+                self._positions.setdefault(r.uid, len(self._rules))
             self._rules.append(r)
+        self._index = None
+
+    def get_position(self, uid) -> int | None:
+        """
+        Return the position of the rule with the given id, None if there is no such rule. If more rules have the same id,
+        the first one is returned.
+
+        :param uid: rule id
+        :type uid: str
+        :return: position of the rule or None
+        :rtype: int | None
+        """
+        if self._positions is None:
+            self._positions = {}
+            for position, rule in enumerate(self._rules):
+                if rule is not None:
+                    self._positions.setdefault(rule.uid, position)
+        return self._positions.get(uid)
+
+    def upsert_rule(self, rule: Rule) -> Rule | None:
+        """
+        Replace the rule with the same id, keeping its position in match order, or add the rule at the end if there is none.
+        The index, if already built, is updated only for the changed position.
+
+        :param rule: rule to add
+        :type rule: Rule
+        :return: the replaced rule or None
+        :rtype: Rule | None
+        """
+        position = self.get_position(rule.uid)
+        if position is None:
+            position = self._positions[rule.uid] = len(self._rules)
+            self._rules.append(None)
+            old_rule = None
+        else:
+            old_rule = self._rules[position]
+            self._unindex_rule(position)
+        self._rules[position] = rule
+        self._index_rule(position)
+        return old_rule
+
+    def remove_rule(self, uid) -> Rule | None:
+        """
+        Remove the rule with the given id. Its position is left empty, so that the positions of the other rules do not change,
+        until more than half of the positions are empty: then the rules are compacted and the index is built again.
+
+        :param uid: rule id
+        :type uid: str
+        :return: the removed rule or None if there is no rule with the given id
+        :rtype: Rule | None
+        """
+        position = self.get_position(uid)
+        if position is None:
+            return None
+        rule = self._rules[position]
+        self._unindex_rule(position)
+        self._rules[position] = None
+        del self._positions[uid]
+        self._removed += 1
+        if self._removed * 2 > len(self._rules):
+            self._compact()
+            self._index = None
+        return rule
+
+    def _compact(self) -> None:
+        """
+        Drop the empty positions left by remove_rule. The positions of the rules change, so the index must be built again.
+
+        :return: no value
+        :rtype: None
+        """
+        if not self._removed:
+            return
+        self._rules = self.rules()
+        self._removed = 0
+        self._positions = None
+
+    def _index_rule(self, position: int) -> None:
+        """
+        Add the rule at position to the index, if it is built. Keys and values of KEYWORD and REGEXP filters shared with
+        other rules are not changed: new filters are checked on their own until the index is built again.
+
+        :param position: rule position
+        :type position: int
+        :return: no value
+        :rtype: None
+        """
+        if self._index is None:
+            return
+        equal_index, scan_positions, precheck_keys, masks = self._index
+        rule = self._rules[position]
+        equal_filter = self._get_index_filter(rule)
+        if equal_filter is None:
+            bisect.insort(scan_positions, position)
+        else:
+            for key in equal_filter._key:
+                key_index = equal_index.setdefault(key, {})
+                for value in equal_filter._value:
+                    bisect.insort(self._get_index_positions(key_index, value), position)
+        key_bits = dict(precheck_keys)
+        mask = 0
+        for key in rule.required_keys():
+            mask |= key_bits.get(key, 0)
+        if position == len(masks):
+            masks.append(mask)
+        else:
+            masks[position] = mask
+
+    @staticmethod
+    def _get_index_positions(key_index: dict, value: str) -> List[int]:
+        """
+        Return the sorted positions of the rules indexed with value, as a list that can be changed in place: the tuple
+        stored by prepare is replaced by a list the first time the positions of value change.
+
+        :param key_index: index of a key, positions by value
+        :type key_index: dict
+        :param value: indexed value
+        :type value: str
+        :return: rule positions
+        :rtype: List[int]
+        """
+        positions = key_index.get(value)
+        if type(positions) is not list:
+            positions = key_index[value] = list(positions or ())
+        return positions
+
+    def _unindex_rule(self, position: int) -> None:
+        """
+        Remove the rule at position from the index, if it is built.
+
+        :param position: rule position
+        :type position: int
+        :return: no value
+        :rtype: None
+        """
+        if self._index is None:
+            return
+        equal_index, scan_positions, _, masks = self._index
+        scan_position = bisect.bisect_left(scan_positions, position)
+        if scan_position < len(scan_positions) and scan_positions[scan_position] == position:
+            del scan_positions[scan_position]
+        # all the EQUALS filters are checked, since the one in the index may have been reordered
+        for f in self._rules[position]._filters:
+            if type(f) is not EqualFilter or len(f._value) > EQUALS_INDEX_MAX_VALUES:
+                continue
+            for key in f._key:
+                key_index = equal_index.get(key, {})
+                for value in f._value:
+                    if value not in key_index:
+                        continue
+                    positions = self._get_index_positions(key_index, value)
+                    index_position = bisect.bisect_left(positions, position)
+                    if index_position < len(positions) and positions[index_position] == position:
+                        del positions[index_position]
+                    if not positions:
+                        del key_index[value]
+                if not key_index:
+                    equal_index.pop(key, None)
+        masks[position] = 0
 
     def get_stats(self, delete=False) -> dict:
         """
@@ -154,6 +720,42 @@ class RuleManager:
         :rtype: dict
         """
         stats = {}
-        for rule in self._rules:
+        for rule in self.rules():
             stats.update(rule.get_stats(delete))
         return stats
+
+    def merge_stats(self, stats: dict) -> None:
+        """
+        Call merge_stats methods of the rules.
+
+        :param stats: stats dictionary in format {uid: stats}
+        :type stats: dict
+        :return: no value
+        :rtype: None
+        """
+        for rule in self.rules():
+            rule.merge_stats(stats)
+
+    def observe_filters(self, enable: bool = True) -> None:
+        """
+        Call observe_filters methods of the rules.
+
+        :param enable: if True, count the events rejected by each filter
+        :type enable: bool
+        :return: no value
+        :rtype: None
+        """
+        for rule in self.rules():
+            rule.observe_filters(enable)
+
+    def reorder_filters(self, observed: bool = False) -> None:
+        """
+        Call reorder_filters methods of the rules.
+
+        :param observed: if True, use the observed rejection rates
+        :type observed: bool
+        :return: no value
+        :rtype: None
+        """
+        for rule in self.rules():
+            rule.reorder_filters(observed)
@@ -1,16 +1,18 @@
 import logging
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from routingfilter.dictquery import DictQuery
 
 from .results import Results
-from .rule import RuleManager
+from .rule import Rule, RuleManager
 
 
 class Stream:
     def __init__(self, stream):
         self.stream = stream
         self._ruleManagers = {}
+        # tags of the rules by id, built when needed (see _get_rule_tag)
+        self._rule_tags: Optional[Dict[str, str]] = None
         self.logger = logging.getLogger(self.__class__.__name__)
 
     def count(self) -> int:
@@ -43,8 +45,8 @@ class Stream:
         tags = event.get(tag_field_name, [])
         if not isinstance(tags, list):
             tags = [tags]
-        # avoid duplicates
-        tags = set(tags)
+        # avoid duplicates, keeping the order of the tags (a set order would change with the hash seed of the process)
+        tags = dict.fromkeys(tags)
 
         # tag all
         if "all" in self._ruleManagers.keys():
@@ -59,6 +61,52 @@ class Stream:
                     match_list.append(match)
         return match_list
 
+    def match_many(self, events: List[DictQuery], tag_field_name: str) -> List[List[Results]]:
+        """
+        Call match for each event, grouping the events by Rule Manager so that each Rule Manager is called once per group.
+        Tags of an event are processed in the same order as match, so the routing history written by a Rule Manager is
+        seen by the following ones.
+
+        :param events: events to check
+        :type events: List[DictQuery]
+        :param tag_field_name: the event field to search into (default "tags")
+        :type tag_field_name: str
+        :return: list of matches for each event
+        :rtype: List[List[Results]]
+        """
+        match_lists = [[] for _ in events]
+        pending = list(range(len(events)))
+        # tag all
+        if "all" in self._ruleManagers.keys():
+            all_matches = self._ruleManagers["all"].match_many(events, "all")
+            pending = [i for i in pending if all_matches[i] is None]
+            for i, all_match in enumerate(all_matches):
+                if all_match is not None:
+                    match_lists[i].append(all_match)
+        event_tags = {}
+        for i in pending:
+            tags = events[i].get(tag_field_name, [])
+            if not isinstance(tags, list):
+                tags = [tags]
+            # avoid duplicates
+            event_tags[i] = [tag for tag in dict.fromkeys(tags) if tag in self._ruleManagers.keys()]
+        # at each round, every event is checked against its next tag
+        round_number = 0
+        while True:
+            buckets = {}
+            for i, tags in event_tags.items():
+                if round_number < len(tags):
+                    buckets.setdefault(tags[round_number], []).append(i)
+            if not buckets:
+                break
+            for tag, positions in buckets.items():
+                matches = self._ruleManagers[tag].match_many([events[i] for i in positions], tag)
+                for i, match in zip(positions, matches):
+                    if match:
+                        match_lists[i].append(match)
+            round_number += 1
+        return match_lists
+
     def add_rulemanager(self, rulemanager: RuleManager | List[RuleManager]) -> None:
         """
         Add one or more Rule Manager to rule manager dictionary. If there is already a Rule Manager for the same tag, error is generated.
@@ -75,6 +123,9 @@ class Stream:
             # if Rule manager already exists error is generated
             if tag in self._ruleManagers and self._ruleManagers[tag] == rm:
                 raise ValueError(f"Rule Manager {rm} already exists for tag {tag}.")
+            # the tags of the rules change unless an empty Rule Manager is added for a new tag
+            if tag in self._ruleManagers or rm.count():
+                self._rule_tags = None
             self._ruleManagers.update({tag: rm})
 
     def delete_rulemanager(self, tags: str | List[str]) -> None:
@@ -91,6 +142,87 @@ class Stream:
         for tag in tags:
             if tag in self._ruleManagers.keys():
                 self._ruleManagers.pop(tag)
+        self._rule_tags = None
+
+    def get_rule_position(self, uid) -> Tuple[str, int] | None:
+        """
+        Return the tag of the Rule Manager containing the rule with the given id and the position of the rule in it.
+
+        :param uid: rule id
+        :type uid: str
+        :return: tag and position, or None if there is no such rule
+        :rtype: Tuple[str, int] | None
+        """
+        tag = self._get_rule_tag(uid)
+        if tag is None:
+            return None
+        return tag, self._ruleManagers[tag].get_position(uid)
+
+    def _get_rule_tag(self, uid) -> Optional[str]:
+        """
+        Return the tag of the Rule Manager containing the rule with the given id, None if there is no such rule. The tags
+        of the rules are built at the first call after the Rule Managers are changed and then kept up to date by upsert_rule
+        and remove_rule. A tag whose Rule Manager no longer has the rule means that the Rule Manager was changed directly:
+        the tags are built again. If more Rule Managers have the same id, the first one is returned.
+
+        :param uid: rule id
+        :type uid: str
+        :return: tag or None
+        :rtype: Optional[str]
+        """
+        if self._rule_tags is not None:
+            tag = self._rule_tags.get(uid)
+            rule_manager = self._ruleManagers.get(tag)
+            if tag is None or (rule_manager is not None and rule_manager.get_position(uid) is not None):
+                return tag
+        self._rule_tags = {}
+        for tag, rule_manager in self._ruleManagers.items():
+            for rule in rule_manager.rules():
+                self._rule_tags.setdefault(rule.uid, tag)
+        return self._rule_tags.get(uid)
+
+    def upsert_rule(self, tag: str, rule: Rule) -> Rule | None:
+        """
+        Replace the rule with the same id, keeping its position, or add the rule at the end of the Rule Manager of tag, which
+        is created if it does not exist. If the rule with the same id is in the Rule Manager of another tag, it is moved.
+        The new rule keeps the stats of the replaced one.
+
+        :param tag: routing tag
+        :type tag: str
+        :param rule: rule to add
+        :type rule: Rule
+        :return: the replaced rule or None
+        :rtype: Rule | None
+        """
+        old_tag = self._get_rule_tag(rule.uid)
+        old_rule = None
+        if old_tag is not None:
+            old_rule_manager = self._ruleManagers[old_tag]
+            old_rule = old_rule_manager._rules[old_rule_manager.get_position(rule.uid)]
+            rule._stats = old_rule._stats
+            if old_tag != tag:
+                old_rule_manager.remove_rule(rule.uid)
+        if tag not in self._ruleManagers:
+            self.add_rulemanager(RuleManager(tag))
+        self._ruleManagers[tag].upsert_rule(rule)
+        if self._rule_tags is not None:
+            self._rule_tags[rule.uid] = tag
+        return old_rule
+
+    def remove_rule(self, uid) -> Rule | None:
+        """
+        Remove the rule with the given id.
+
+        :param uid: rule id
+        :type uid: str
+        :return: the removed rule or None if there is no such rule
+        :rtype: Rule | None
+        """
+        tag = self._get_rule_tag(uid)
+        if tag is None:
+            return None
+        del self._rule_tags[uid]
+        return self._ruleManagers[tag].remove_rule(uid)
 
     def get_stats(self, delete=False) -> dict:
         """
@@ -105,3 +237,39 @@ class Stream:
         for rm in self._ruleManagers.values():
             stats.update(rm.get_stats(delete))
         return stats
+
+    def merge_stats(self, stats: dict) -> None:
+        """
+        Call merge_stats of all Rule Manager.
+
+        :param stats: stats dictionary in format {uid: stats}
+        :type stats: dict
+        :return: no value
+        :rtype: None
+        """
+        for rm in self._ruleManagers.values():
+            rm.merge_stats(stats)
+
+    def observe_filters(self, enable: bool = True) -> None:
+        """
+        Call observe_filters of all Rule Manager.
+
+        :param enable: if True, count the events rejected by each filter
+        :type enable: bool
+        :return: no value
+        :rtype: None
+        """
+        for rm in self._ruleManagers.values():
+            rm.observe_filters(enable)
+
+    def reorder_filters(self, observed: bool = False) -> None:
+        """
+        Call reorder_filters of all Rule Manager.
+
+        :param observed: if True, use the observed rejection rates
+        :type observed: bool
+        :return: no value
+        :rtype: None
+        """
+        for rm in self._ruleManagers.values():
+            rm.reorder_filters(observed)
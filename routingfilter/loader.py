@@ -0,0 +1,211 @@
+import json
+import os
+import re
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# number of bytes read from a rule file at a time
+READ_CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+# strings and other characters up to the next character changing the nesting of a value or string not terminated in the buffer
+_NESTED_CONTENT = re.compile(rb'(?:[^"{}\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_SCALAR_END = re.compile(rb"[ \t\n\r,}\]]")
+
+
+def get_decoder() -> Callable[[bytes], Any]:
+    """
+    Return the fastest json decoder installed: orjson.loads if orjson is installed, json.loads otherwise.
+
+    :return: function decoding json bytes
+    :rtype: Callable[[bytes], Any]
+    """
+    return orjson.loads if orjson is not None else json.loads
+
+
+class RuleFileScanner:
+    """Incremental reader of a json rule file, in the format of Routing.load_from_dicts.
+
+    The file is read in chunks and only the bytes of one rule at a time are decoded, so that memory does not grow with
+    the file size. The sections are returned in file order: the rules of a tag must be read before the next tag, since
+    the file is read only once. Keys other than "rules" in a stream section are skipped.
+
+    ::
+
+        with open("rules.json", "rb") as file:
+            for stream_type, tags in RuleFileScanner(file).sections():
+                for tag, rules in tags:
+                    for rule in rules:
+                        ...
+    """
+
+    def __init__(self, file: BinaryIO, decoder: Optional[Callable[[bytes], Any]] = None, chunk_size: int = READ_CHUNK_SIZE):
+        """
+        :param file: rule file opened in binary mode
+        :type file: BinaryIO
+        :param decoder: function decoding the json bytes of a rule (default get_decoder())
+        :type decoder: Optional[Callable[[bytes], Any]]
+        :param chunk_size: number of bytes read at a time
+        :type chunk_size: int
+        """
+        self._file = file
+        self._decoder = decoder or get_decoder()
+        self._chunk_size = chunk_size
+        self._buffer = b""
+        self._position = 0
+        # file offset of the start of the buffer, for the error messages
+        self._offset = 0
+
+    def sections(self) -> Iterator[Tuple[str, Iterator[Tuple[str, Iterator[dict]]]]]:
+        """
+        Return the stream sections of the file: for each stream type, the tags with their rules.
+
+        :return: stream type and tags of each stream section
+        :rtype: Iterator[Tuple[str, Iterator[Tuple[str, Iterator[dict]]]]]
+        """
+        for stream_type in self._members():
+            tags = self._tags()
+            yield stream_type, tags
+            # the next stream section starts after the unread tags
+            for _ in tags:
+                pass
+
+    def _tags(self) -> Iterator[Tuple[str, Iterator[dict]]]:
+        for key in self._members():
+            if key != "rules":
+                self._read_value()
+                continue
+            for tag in self._members():
+                rules = self._rules()
+                yield tag, rules
+                for _ in rules:
+                    pass
+
+    def _rules(self) -> Iterator[dict]:
+        for _ in self._elements():
+            yield self._decoder(self._read_value())
+
+    def _members(self) -> Iterator[str]:
+        """Return the keys of the object starting at the current position: the caller must read each value."""
+        self._expect(b"{")
+        if self._peek() == b"}":
+            self._position += 1
+            return
+        while True:
+            key = self._decoder(self._read_value())
+            if not isinstance(key, str):
+                self._error("expected a string key")
+            self._expect(b":")
+            yield key
+            char = self._peek()
+            self._position += 1
+            if char == b"}":
+                return
+            if char != b",":
+                self._error("expected ',' or '}'")
+
+    def _elements(self) -> Iterator[None]:
+        """Go through the array starting at the current position: the caller must read each element."""
+        self._expect(b"[")
+        if self._peek() == b"]":
+            self._position += 1
+            return
+        while True:
+            yield
+            char = self._peek()
+            self._position += 1
+            if char == b"]":
+                return
+            if char != b",":
+                self._error("expected ',' or ']'")
+
+    def _read_value(self) -> bytes:
+        """Return the bytes of the value starting at the current position and move after it."""
+        char = self._peek()
+        if not char:
+            self._error("unexpected end of file")
+        # the consumed bytes are dropped between values, so a value being read stays in the buffer
+        if self._position >= self._chunk_size:
+            self._offset += self._position
+            self._buffer = self._buffer[self._position :]
+            self._position = 0
+        start = self._position
+        if char == b'"':
+            while (match := _STRING.match(self._buffer, start)) is None:
+                if not self._fill():
+                    self._error("unterminated string")
+            self._position = match.end()
+        elif char in b"{[":
+            depth = 0
+            position = start
+            while True:
+                # the content between brackets is skipped by a regex, so that the loop runs once per bracket
+                position = _NESTED_CONTENT.match(self._buffer, position).end()
+                char = self._buffer[position : position + 1]
+                if not char or char == b'"':
+                    # the buffer ends inside the value or inside a string
+                    if not self._fill():
+                        self._error("unexpected end of file")
+                    continue
+                position += 1
+                if char in b"{[":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        break
+            self._position = position
+        else:
+            while (match := _SCALAR_END.search(self._buffer, start)) is None and self._fill():
+                pass
+            self._position = match.start() if match is not None else len(self._buffer)
+        return self._buffer[start : self._position]
+
+    def _peek(self) -> bytes:
+        """Skip whitespace and return the next byte, or an empty bytes object at the end of the file."""
+        while True:
+            self._position = _WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer) or not self._fill():
+                return self._buffer[self._position : self._position + 1]
+
+    def _expect(self, char: bytes) -> None:
+        if self._peek() != char:
+            self._error(f"expected '{char.decode()}'")
+        self._position += 1
+
+    def _fill(self) -> bool:
+        """Append a chunk of the file to the buffer, returning False at the end of the file."""
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            return False
+        self._buffer += chunk
+        return True
+
+    def _error(self, message: str) -> None:
+        name = getattr(self._file, "name", self._file)
+        raise ValueError(f"Invalid rule file {name}: {message} at byte {self._offset + self._position}")
+
+
+def iter_rule_files(files: Iterable[str | os.PathLike | BinaryIO], decoder: Optional[Callable[[bytes], Any]] = None) -> Iterator[Tuple[str, Iterator]]:
+    """
+    Return the stream sections of the rule files, read one after the other with RuleFileScanner. Paths are opened and
+    closed here, file objects must be opened in binary mode and are left open.
+
+    :param files: rule file paths or binary file objects
+    :type files: Iterable[str | os.PathLike | BinaryIO]
+    :param decoder: function decoding the json bytes of a rule (default get_decoder())
+    :type decoder: Optional[Callable[[bytes], Any]]
+    :return: stream type and tags of each stream section
+    :rtype: Iterator[Tuple[str, Iterator]]
+    """
+    for file in files:
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, "rb") as rule_file:
+                yield from RuleFileScanner(rule_file, decoder).sections()
+        else:
+            yield from RuleFileScanner(file, decoder).sections()
@@ -0,0 +1,124 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterable, List, Optional, Tuple
+
+from .filters.results import Results
+from .routing import Routing
+
+# Routing object of a worker process, set by _init_worker
+_worker_routing = None
+
+
+def _init_worker(routing: Routing) -> None:
+    """
+    Store the Routing object in the worker process. With fork it is inherited from the parent, otherwise it is unpickled.
+
+    :param routing: routing with the rules loaded
+    :type routing: Routing
+    :return: no value
+    :rtype: None
+    """
+    global _worker_routing
+    _worker_routing = routing
+    # stats inherited from the parent are already counted there
+    _worker_routing.get_stats(delete=True)
+
+
+def _match_chunk(events: List[dict], type_: str, tag_field_name: str) -> Tuple[List[List[Results]], List[dict], dict]:
+    """
+    Match a chunk of events in a worker process.
+
+    :param events: events to check
+    :type events: List[dict]
+    :param type_: stream type, it can be "streams" or "customer"
+    :type type_: str
+    :param tag_field_name: the event field to search into
+    :type tag_field_name: str
+    :return: results of each event, routing history of each event and stats collected since the previous chunk
+    :rtype: Tuple[List[List[Results]], List[dict], dict]
+    """
+    results = _worker_routing.match_many(events, type_, tag_field_name)
+    routing_histories = [event["certego"]["routing_history"] for event in events]
+    return results, routing_histories, _worker_routing.get_stats(delete=True)
+
+
+class ParallelRouting:
+    """Match events with a pool of processes, each one with its own copy of the rules of a Routing object.
+
+    The rules are copied into the workers when they start, at the first call of match_many: the Routing object must not
+    be changed after that. The workers are forked when the platform supports it, otherwise the Routing object is pickled.
+    The stats collected by the workers are merged into the Routing object, so that its get_stats returns all the hits.
+    Events are pickled to the workers, so the same event object must not appear twice in a batch.
+
+    ::
+
+        with ParallelRouting(routing, workers=4) as parallel_routing:
+            results = parallel_routing.match_many(events)
+    """
+
+    def __init__(self, routing: Routing, workers: Optional[int] = None, chunk_size: int = 1000, start_method: Optional[str] = None):
+        """
+        :param routing: routing with the rules loaded
+        :type routing: Routing
+        :param workers: number of worker processes (default the number of CPUs)
+        :type workers: Optional[int]
+        :param chunk_size: number of events sent to a worker at a time
+        :type chunk_size: int
+        :param start_method: multiprocessing start method (default "fork" if available)
+        :type start_method: Optional[str]
+        """
+        if chunk_size < 1:
+            raise ValueError(f"Invalid chunk_size {chunk_size}: it must be a positive integer")
+        if start_method is None and "fork" in multiprocessing.get_all_start_methods():
+            start_method = "fork"
+        self.routing = routing
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context(start_method), initializer=_init_worker, initargs=(routing,)
+        )
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def match_many(self, events: Iterable[dict], type_: str = "streams", tag_field_name: str = "tags") -> List[List[Results]]:
+        """
+        Split events in chunks, match them in the worker processes and return the results of each event, in the same order.
+        As in Routing.match, the routing history of each event is updated.
+
+        :param events: events to check
+        :type events: Iterable[dict]
+        :param type_: stream type, it can be "streams" or "customer"
+        :type type_: str
+        :param tag_field_name: the event field to search into
+        :type tag_field_name: str
+        :return: for each event, a list of dictionaries containing the matched rules and the outputs
+        :rtype: List[List[Results]]
+        """
+        # check stream before sending events to workers
+        self.routing._get_stream(type_)
+        events = list(events)
+        chunks = [events[i : i + self.chunk_size] for i in range(0, len(events), self.chunk_size)]
+        res = []
+        for chunk, (results, routing_histories, stats) in zip(chunks, self._executor.map(_match_chunk, chunks, repeat(type_), repeat(tag_field_name))):
+            for event, routing_history in zip(chunk, routing_histories):
+                event.setdefault("certego", {}).setdefault("routing_history", {}).update(routing_history)
+            self.routing.merge_stats(stats)
+            res.extend(results)
+        return res
+
+    def close(self) -> None:
+        """
+        Shut down the worker processes.
+
+        :return: no value
+        :rtype: None
+        """
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
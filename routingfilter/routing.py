@@ -1,22 +1,83 @@
+import asyncio
+import gc
+import hashlib
 import json
 import logging
+import os
+import pickle
 import uuid
-from typing import List, Optional
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, AsyncIterable, AsyncIterator, BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple
 
-from .dictquery import DictQuery
+from . import __version__
+from .clock import Clock, SystemClock
+from .dictquery import CachedDictQuery
 from .filters import filters
 from .filters.results import Results
 from .filters.rule import Rule, RuleManager
 from .filters.stream import Stream
+from .loader import iter_rule_files
+from .stats import ExactStats, Stats
+
+# version of the snapshot format written by save_snapshot: snapshots with another format are not loaded
+SNAPSHOT_FORMAT = 1
 
 
 class Routing:
-    def __init__(self):
+    def __init__(self, clock: Optional[Clock] = None, stats: Optional[Callable[[], Stats]] = None):
+        """
+        :param clock: source of the routing history timestamps (default SystemClock, see routingfilter.clock)
+        :type clock: Optional[Clock]
+        :param stats: factory of the stats of each rule loaded (default ExactStats, see routingfilter.stats), e.g. functools.partial(TopKStats, 10)
+        :type stats: Optional[Callable[[], Stats]]
+        """
         self.streams = Stream("streams")
         self.customer = Stream("customers")
         self.variables = {}
+        # variables whose values are in the pool, SharedValues by list of variable names (see _substitute_variables)
+        self._variables_pool = (self.variables, {})
+        self.clock = clock or SystemClock()
+        self.stats = stats or ExactStats
+        # digest of the rules and variables hashed so far and the sources loaded after them, hashed when the digest is
+        # needed (see rules_digest)
+        self._rules_digest = ""
+        self._digest_sources = []
         self.logger = logging.getLogger(self.__class__.__name__)
 
+    @property
+    def rules_digest(self) -> str:
+        """
+        Digest of the rules and variables loaded so far (see _digest_sections), saved in the snapshots to check that they
+        are up to date. It is computed only when it is read: until then, the rule dictionaries loaded are referenced and
+        the rule files are read again, so they must not be changed in the meantime.
+
+        :return: hexadecimal digest
+        :rtype: str
+        """
+        if self._digest_sources:
+            digest = self._rules_digest
+            for source in self._digest_sources:
+                match source:
+                    case ("dicts", rules_list, variables):
+                        digest = self._digest_sections(digest, self._iter_rule_dicts(rules_list), variables)
+                    case ("files", files, decoder, variables):
+                        digest = self._digest_sections(digest, iter_rule_files(files, decoder), variables)
+                    case ("value", value):
+                        digest = self._digest(digest, value)
+            self._rules_digest, self._digest_sources = digest, []
+        return self._rules_digest
+
+    @rules_digest.setter
+    def rules_digest(self, digest: str) -> None:
+        self._rules_digest, self._digest_sources = digest, []
+
+    def __getstate__(self) -> dict:
+        # the sources not hashed yet may not be picklable (e.g. a custom decoder), so the digest is computed first
+        state = self.__dict__.copy()
+        state["_rules_digest"], state["_digest_sources"] = self.rules_digest, []
+        return state
+
     def count(self) -> int:
         """
         Return the number of the rules.
@@ -31,6 +92,8 @@ class Routing:
     def get_stats(self, delete: bool = False) -> dict:
         """
         Call get_stats of streams and return the stats. If delete is True, reset the stats.
+        The hits of each rule are the ones kept by its stats (see the stats argument of Routing): all the event names with
+        ExactStats, only the most frequent ones with TopKStats and CountMinStats, the total with TotalStats.
 
         Return value example
         ::
@@ -55,6 +118,45 @@ class Routing:
         stats = {"streams": self.streams.get_stats(delete), "customers": self.customer.get_stats(delete)}
         return stats
 
+    def merge_stats(self, stats: dict) -> None:
+        """
+        Add stats, in the format returned by get_stats, to the stats of the rules. It is used to collect the stats of
+        rules matched in other processes (e.g. by ParallelRouting).
+
+        :param stats: stream and customer stats
+        :type stats: dict
+        :return: no value
+        :rtype: None
+        """
+        self.streams.merge_stats(stats.get("streams", {}))
+        self.customer.merge_stats(stats.get("customers", {}))
+
+    def observe_filters(self, enable: bool = True) -> None:
+        """
+        Start (or stop, if enable is False) counting the events rejected by each filter of each rule (see Rule.observe_filters).
+        Counting makes matching slower: it should be enabled for a sample of the events and followed by reorder_filters(observed=True).
+
+        :param enable: if True, count the events rejected by each filter
+        :type enable: bool
+        :return: no value
+        :rtype: None
+        """
+        self.streams.observe_filters(enable)
+        self.customer.observe_filters(enable)
+
+    def reorder_filters(self, observed: bool = False) -> None:
+        """
+        Reorder the filters of each rule so that the cheapest (and, if observed is True, the most selective) ones are
+        checked first. The results of the rules do not change (see Rule.reorder_filters).
+
+        :param observed: if True, use the rejection rates counted since observe_filters was called
+        :type observed: bool
+        :return: no value
+        :rtype: None
+        """
+        self.streams.reorder_filters(observed)
+        self.customer.reorder_filters(observed)
+
     def match(self, event: dict, type_: str = "streams", tag_field_name: str = "tags") -> List[Results]:
         """
         Process a single event message and call the right stream match method.
@@ -74,25 +176,152 @@ class Routing:
         if "routing_history" not in event["certego"]:
             event["certego"]["routing_history"] = {}
 
-        event_dictquery = DictQuery(event)
+        # each path is resolved once per event, no matter how many rules look it up
+        event_dictquery = CachedDictQuery(event, timestamp=self.clock.batch())
 
         # check stream
-        if type_ == "streams":
-            stream = self.streams
-        elif type_ == "customers":
-            stream = self.customer
-        else:
-            self.logger.error(f"Error during matching. Invalid Stream: {type_}")
-            raise ValueError(f"Invalid Stream: {type_}.")
+        stream = self._get_stream(type_)
 
         res = stream.match(event_dictquery, tag_field_name)
         event["certego"]["routing_history"].update(event_dictquery["certego"]["routing_history"])
         return res
 
-    def load_from_dicts(self, rules_list: List[dict], validate_rules: bool = True, variables: Optional[dict] = None) -> None:
+    def match_many(self, events: Iterable[dict], type_: str = "streams", tag_field_name: str = "tags") -> List[List[Results]]:
+        """
+        Process a batch of events and return the results of each one, in the same order. The result for each event is the
+        same as calling match on it, but the stream is resolved once and the events are grouped by Rule Manager.
+
+        :param events: events to check
+        :type events: Iterable[dict]
+        :param type_: stream type, it can be "streams" or "customer"
+        :type type_: str
+        :param tag_field_name: the event field to search into
+        :type tag_field_name: str
+        :return: for each event, a list of dictionaries containing the matched rules and the outputs
+        :rtype: List[List[Results]]
+        """
+        stream = self._get_stream(type_)
+        events = list(events)
+        timestamp = self.clock.batch()
+        event_dictqueries = []
+        for event in events:
+            # create routing_history if not exists
+            if "certego" not in event.keys():
+                event["certego"] = {}
+            if "routing_history" not in event["certego"]:
+                event["certego"]["routing_history"] = {}
+            event_dictqueries.append(CachedDictQuery(event, timestamp=timestamp))
+
+        res = stream.match_many(event_dictqueries, tag_field_name)
+        for event, event_dictquery in zip(events, event_dictqueries):
+            event["certego"]["routing_history"].update(event_dictquery["certego"]["routing_history"])
+        return res
+
+    async def amatch_stream(
+        self,
+        events: AsyncIterable[dict],
+        type_: str = "streams",
+        tag_field_name: str = "tags",
+        batch_size: int = 100,
+        max_in_flight: int = 4,
+        executor: Optional[Executor] = None,
+    ) -> AsyncIterator[List[Results]]:
+        """
+        Asynchronously match the events of an async iterable and yield the results of each one, in the same order.
+        Events are collected in batches of batch_size and each batch is matched by match_many in executor, so that
+        the event loop is not blocked. When max_in_flight batches are pending, no more events are read until the oldest
+        one is done. An event must not be changed until its results are yielded.
+        The default executor is a dedicated thread: a custom executor must run the batches one at a time, in order,
+        because the rules (e.g. the stats) are not thread safe.
+
+        ::
+
+            async for results in routing.amatch_stream(events):
+                ...
+
+        :param events: events to check
+        :type events: AsyncIterable[dict]
+        :param type_: stream type, it can be "streams" or "customer"
+        :type type_: str
+        :param tag_field_name: the event field to search into
+        :type tag_field_name: str
+        :param batch_size: max number of events matched in a batch
+        :type batch_size: int
+        :param max_in_flight: max number of batches waiting to be matched or yielded
+        :type max_in_flight: int
+        :param executor: executor that matches the batches (default a dedicated thread)
+        :type executor: Optional[Executor]
+        :return: for each event, a list of dictionaries containing the matched rules and the outputs
+        :rtype: AsyncIterator[List[Results]]
+        """
+        self._get_stream(type_)
+        if batch_size < 1 or max_in_flight < 1:
+            raise ValueError(f"Invalid batch_size {batch_size} or max_in_flight {max_in_flight}: they must be positive integers")
+        loop = asyncio.get_running_loop()
+        dedicated_executor = executor is None
+        if dedicated_executor:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.__class__.__name__)
+        in_flight = deque()
+        try:
+            batch = []
+            async for event in events:
+                batch.append(event)
+                if len(batch) < batch_size:
+                    continue
+                in_flight.append(loop.run_in_executor(executor, self.match_many, batch, type_, tag_field_name))
+                batch = []
+                # yield the batches already done and wait for the oldest one if too many are pending
+                while in_flight and (in_flight[0].done() or len(in_flight) >= max_in_flight):
+                    for res in await in_flight.popleft():
+                        yield res
+            if batch:
+                in_flight.append(loop.run_in_executor(executor, self.match_many, batch, type_, tag_field_name))
+            while in_flight:
+                for res in await in_flight.popleft():
+                    yield res
+        finally:
+            for future in in_flight:
+                future.cancel()
+            if dedicated_executor:
+                executor.shutdown(wait=False)
+
+    def _get_stream(self, type_: str) -> Stream:
+        """
+        Return the stream of the given type.
+
+        :param type_: stream type, it can be "streams" or "customer"
+        :type type_: str
+        :return: the stream
+        :rtype: Stream
+        """
+        if type_ == "streams":
+            return self.streams
+        elif type_ == "customers":
+            return self.customer
+        self.logger.error(f"Error during matching. Invalid Stream: {type_}")
+        raise ValueError(f"Invalid Stream: {type_}.")
+
+    def load_from_dicts(
+        self,
+        rules_list: List[dict],
+        validate_rules: bool = True,
+        variables: Optional[dict] = None,
+        compile_rules: bool = False,
+        share_keywords: bool = False,
+        share_regexps: bool = False,
+        intern_filters: bool = True,
+        reorder_filters: bool = False,
+    ) -> None:
         """
         Load routing rule configuration from a dictionary. It instances Filters, Stream, Rule and RuleManager objects by checking dictionaries in rules_list.
+        Rules without id get a random id: rules_list is not changed.
         An exception is raised if arguments are invalid.
+        If compile_rules is True, the filters of each rule are compiled into a single function (see Rule.compile).
+        If share_keywords is True, KEYWORD filters with the same keys in a rule manager are searched with a single automaton.
+        If share_regexps is True, REGEXP filters with the same keys in a rule manager are searched with a single fused regex.
+        If intern_filters is True, identical filters (same type, keys and values) in rules_list are a single object shared
+        by all the rules using them, and its result is computed once per event.
+        If reorder_filters is True, the filters of each rule are sorted by cost class, so that the cheapest are checked first (see Rule.reorder_filters).
 
         :param rules_list: list of dictionary representing routing rule configurations
         :type rules_list: List[dict]
@@ -100,6 +329,16 @@ class Routing:
         :type validate_rules: bool
         :param variables:
         :type variables: Optional[dict]
+        :param compile_rules: if True, compile each rule into a single match function
+        :type compile_rules: bool
+        :param share_keywords: if True, share the KEYWORD filters automaton in each rule manager
+        :type share_keywords: bool
+        :param share_regexps: if True, fuse the REGEXP filters regexes in each rule manager
+        :type share_regexps: bool
+        :param intern_filters: if True, share identical filters among rules
+        :type intern_filters: bool
+        :param reorder_filters: if True, check the cheapest filters of each rule first
+        :type reorder_filters: bool
         :return: no value
         :rtype None
         """
@@ -109,40 +348,383 @@ class Routing:
         if not isinstance(rules_list, list):
             self.logger.error(f"Invalid argument: {rules_list} is not a list.")
             raise ValueError(f"Invalid argument: {rules_list} is not a list.")
+        self._digest_sources.append(("dicts", rules_list, variables))
+        self._load_sections(
+            self._iter_rule_dicts(rules_list),
+            variables,
+            compile_rules=compile_rules,
+            share_keywords=share_keywords,
+            share_regexps=share_regexps,
+            intern_filters=intern_filters,
+            reorder_filters=reorder_filters,
+        )
+
+    def load_from_files(
+        self,
+        files: List[str | os.PathLike | BinaryIO],
+        validate_rules: bool = True,
+        variables: Optional[dict] = None,
+        decoder: Optional[Callable[[bytes], Any]] = None,
+        **kwargs,
+    ) -> None:
+        """
+        Load routing rule configurations from json rule files, in the format of load_from_dicts. The files are parsed
+        incrementally and the rules are built one batch at a time, so that the whole files are never in memory.
+        The decoder turns the json bytes of each rule into a dictionary: by default it is orjson.loads if orjson is
+        installed, json.loads otherwise (see routingfilter.loader).
+
+        :param files: rule file paths or file objects opened in binary mode
+        :type files: List[str | os.PathLike | BinaryIO]
+        :param validate_rules:
+        :type validate_rules: bool
+        :param variables:
+        :type variables: Optional[dict]
+        :param decoder: function decoding the json bytes of a rule
+        :type decoder: Optional[Callable[[bytes], Any]]
+        :param kwargs: other arguments of load_from_dicts (e.g. compile_rules)
+        :type kwargs: dict
+        :return: no value
+        :rtype: None
+        """
+        if variables:
+            self.variables = variables
+        if not isinstance(files, list):
+            self.logger.error(f"Invalid argument: {files} is not a list.")
+            raise ValueError(f"Invalid argument: {files} is not a list.")
+        if all(isinstance(file, (str, os.PathLike)) for file in files):
+            self._digest_sources.append(("files", list(files), decoder, variables))
+            self._load_sections(iter_rule_files(files, decoder), variables, **kwargs)
+        else:
+            # file objects cannot be read again, so their rules are hashed while they are loaded, after the sources loaded before
+            self._rules_digest = self.rules_digest
+            self._load_sections(iter_rule_files(files, decoder), variables, digest_rules=True, **kwargs)
+
+    def _load_sections(
+        self,
+        sections: Iterable[Tuple[str, Iterable[Tuple[str, Iterable[dict]]]]],
+        variables: Optional[dict],
+        compile_rules: bool = False,
+        share_keywords: bool = False,
+        share_regexps: bool = False,
+        intern_filters: bool = True,
+        reorder_filters: bool = False,
+        digest_rules: bool = False,
+    ) -> None:
+        """
+        Load the rules of the stream sections of load_from_dicts and load_from_files. The rules are read and built one at a time.
+        If digest_rules is True, the rules are hashed into rules_digest while they are loaded, otherwise the caller adds
+        their source to the sources hashed when the digest is read.
+
+        :param sections: stream type and tags, with their rules, of each stream section
+        :type sections: Iterable[Tuple[str, Iterable[Tuple[str, Iterable[dict]]]]]
+        :param variables: variables of the rules
+        :type variables: Optional[dict]
+        :param digest_rules: if True, hash the rules while loading them
+        :type digest_rules: bool
+        :return: no value
+        :rtype: None
+        """
+        if digest_rules and variables:
+            self._rules_digest = self._digest(self._rules_digest, variables)
+        rule_managers = []
+        compiled_rules = []
+        # filters by signature: the pool is dropped after loading, so that it takes no memory
+        filter_pool = {}
+        for stream_type, tags in sections:
+            # check stream
+            if stream_type == "streams":
+                streams = self.streams
+            elif stream_type == "customers":
+                streams = self.customer
+            else:
+                self.logger.error(f"Error during loading rule. Invalid Stream: {stream_type}")
+                raise ValueError(f"Invalid Stream: {stream_type}.")
+            # the rules are added to the rule managers directly: the stream builds the tags of the rules again
+            streams._rule_tags = None
+
+            for tag, rules in tags:
+                # check if rule manager with tag exists
+                if tag in streams._ruleManagers.keys():
+                    rule_manager = streams._ruleManagers[tag]
+                else:
+                    rule_manager = RuleManager(tag)
+                    streams.add_rulemanager(rule_manager)
+                if share_keywords:
+                    rule_manager.share_keywords = True
+                if share_regexps:
+                    rule_manager.share_regexps = True
+                if rule_manager not in rule_managers:
+                    rule_managers.append(rule_manager)
+                for rule in rules:
+                    if digest_rules:
+                        self._rules_digest = self._digest(self._rules_digest, [stream_type, tag, rule])
+                    if "id" not in rule.keys():
+                        # a copy, so that the rules passed keep their digest (see load_snapshot)
+                        rule = dict(rule, id=str(uuid.uuid4()))
+                    # add rule to rule manager and filters to rule
+                    output = rule[stream_type] if stream_type in rule.keys() else None
+                    uid = rule["id"]
+                    try:
+                        filter_list = self._get_filters(rule, variables)
+                        if intern_filters:
+                            filter_list = [self._intern_filter(f, filter_pool) for f in filter_list]
+                        rule_object = Rule(uid=uid, output=output, stats=self.stats())
+                        rule_object.add_filter(filter_list)
+                        if reorder_filters:
+                            rule_object.reorder_filters()
+                        if compile_rules:
+                            compiled_rules.append(rule_object)
+                        rule_manager.add_rule(rule_object)
+                    except Exception as e:
+                        self.logger.error(
+                            f"Error during creating filter list. Impossible to create Rule {uid} with output: {output}. The error was '{e}'. The entire rule is {rule}."
+                        )
+        # rules are compiled when all their filters are interned, so that shared filters are memoized
+        for rule_object in compiled_rules:
+            rule_object.compile()
+        # build the rule managers indexes now instead of at the first match
+        for rule_manager in rule_managers:
+            rule_manager.prepare()
+
+    @staticmethod
+    def _iter_rule_dicts(rules_list: List[dict]) -> Iterator[Tuple[str, Iterator[Tuple[str, List[dict]]]]]:
+        """
+        Return the stream sections of the rule dictionaries, in the format read by _load_sections. The rules of a
+        section are accessed only when its tags are read, after the stream type has been checked.
+
+        :param rules_list: list of dictionary representing routing rule configurations
+        :type rules_list: List[dict]
+        :return: stream type and tags of each stream section
+        :rtype: Iterator[Tuple[str, Iterator[Tuple[str, List[dict]]]]]
+        """
+
+        def iter_tags(stream_section: dict) -> Iterator[Tuple[str, List[dict]]]:
+            yield from stream_section["rules"].items()
+
         for rule_file in rules_list:
-            # access to stream
             for stream_type in rule_file.keys():
-                # check stream
-                if stream_type == "streams":
-                    streams = self.streams
-                elif stream_type == "customers":
-                    streams = self.customer
-                else:
-                    self.logger.error(f"Error during loading rule. Invalid Stream: {stream_type}")
-                    raise ValueError(f"Invalid Stream: {stream_type}.")
-
-                for tag in rule_file[stream_type]["rules"].keys():
-                    # check if rule manager with tag exists
-                    if tag in streams._ruleManagers.keys():
-                        rule_manager = streams._ruleManagers[tag]
-                    else:
-                        rule_manager = RuleManager(tag)
-                        streams.add_rulemanager(rule_manager)
-                    for rule in rule_file[stream_type]["rules"][tag]:
-                        # add rule to rule manager and filters to rule
-                        output = rule[stream_type] if stream_type in rule.keys() else None
-                        if "id" not in rule.keys():
-                            rule["id"] = str(uuid.uuid4())
-                        uid = rule["id"]
-                        try:
-                            filter_list = self._get_filters(rule, variables)
-                            rule_object = Rule(uid=uid, output=output)
-                            rule_manager.add_rule(rule_object)
-                            rule_object.add_filter(filter_list)
-                        except Exception as e:
-                            self.logger.error(
-                                f"Error during creating filter list. Impossible to create Rule {uid} with output: {output}. The error was '{e}'. The entire rule is {rule}."
-                            )
+                yield stream_type, iter_tags(rule_file[stream_type])
+
+    def reload(self, rules_list: List[dict], variables: Optional[dict] = None, **kwargs) -> None:
+        """
+        Replace all the rules with the ones in rules_list without stopping the matching. The new rules are loaded into new
+        Stream objects, which replace the current ones only when they are ready: matches in progress end with the old rules,
+        the following ones use the new rules. If loading fails, the current rules are kept.
+        The stats of the rules whose id is in both the old and the new rules of a stream are carried over.
+
+        :param rules_list: list of dictionary representing routing rule configurations
+        :type rules_list: List[dict]
+        :param variables: variables of the rules (default the current ones)
+        :type variables: Optional[dict]
+        :param kwargs: other arguments of load_from_dicts (e.g. compile_rules)
+        :type kwargs: dict
+        :return: no value
+        :rtype: None
+        """
+        routing = Routing(clock=self.clock, stats=self.stats)
+        routing.load_from_dicts(rules_list, variables=self.variables if variables is None else variables, **kwargs)
+        self._share_stats(self.streams, routing.streams)
+        self._share_stats(self.customer, routing.customer)
+        # match and match_many read each stream once, so the assignments swap the rules for the next calls
+        self.streams, self.customer, self.variables = routing.streams, routing.customer, routing.variables
+        self._rules_digest, self._digest_sources = routing._rules_digest, routing._digest_sources
+
+    def upsert_rule(self, type_: str, tag: str, rule: dict, compile_rule: bool = False, reorder_filters: bool = False) -> str:
+        """
+        Add a rule, in the same format as the rules of load_from_dicts, to the given stream and tag. If a rule with the same
+        id exists, it is replaced: the new rule keeps its position in match order and its stats. Otherwise, the rule is
+        added after the other rules of the tag. The indexes of the rule managers are updated only for the changed rule.
+        The current variables are used. An exception is raised if the rule is invalid.
+
+        :param type_: stream type, it can be "streams" or "customers"
+        :type type_: str
+        :param tag: routing tag
+        :type tag: str
+        :param rule: dictionary representing a routing rule configuration
+        :type rule: dict
+        :param compile_rule: if True, compile the rule into a single match function
+        :type compile_rule: bool
+        :param reorder_filters: if True, check the cheapest filters of the rule first
+        :type reorder_filters: bool
+        :return: id of the rule
+        :rtype: str
+        """
+        stream = self._get_stream(type_)
+        output = rule[type_] if type_ in rule.keys() else None
+        uid = rule["id"] if "id" in rule.keys() else str(uuid.uuid4())
+        try:
+            rule_object = Rule(uid=uid, output=output, stats=self.stats())
+            rule_object.add_filter(self._get_filters(rule, self.variables or None))
+        except Exception as e:
+            self.logger.error(
+                f"Error during creating filter list. Impossible to create Rule {uid} with output: {output}. The error was '{e}'. The entire rule is {rule}."
+            )
+            raise ValueError(f"Invalid rule {uid}: {e}")
+        if reorder_filters:
+            rule_object.reorder_filters()
+        if compile_rule:
+            rule_object.compile()
+        stream.upsert_rule(tag, rule_object)
+        # the digest changes only with the rules actually loaded
+        self._digest_sources.append(("value", ["upsert", type_, tag, rule]))
+        return uid
+
+    def remove_rule(self, uid: str) -> bool:
+        """
+        Remove the rule with the given id from the stream containing it. The indexes of the rule managers are updated only
+        for the removed rule.
+
+        :param uid: rule id
+        :type uid: str
+        :return: True if the rule was removed, False if there is no rule with the given id
+        :rtype: bool
+        """
+        for stream in (self.streams, self.customer):
+            if stream.remove_rule(uid) is not None:
+                self._digest_sources.append(("value", ["remove", uid]))
+                return True
+        return False
+
+    def save_snapshot(self, path: str) -> None:
+        """
+        Save the loaded rules to a binary file, which load_snapshot loads without building the rules again.
+        The file contains a header, with the snapshot format, the library version and the digest of the source rules
+        (see rules_digest), and the pickled streams and variables.
+
+        :param path: snapshot file path
+        :type path: str
+        :return: no value
+        :rtype: None
+        """
+        header = {"format": SNAPSHOT_FORMAT, "version": __version__, "rules_digest": self.rules_digest}
+        with open(path, "wb") as file:
+            pickle.dump(header, file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump((self.streams, self.customer, self.variables), file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_snapshot(self, path: str, rules_list: Optional[List[dict]] = None, variables: Optional[dict] = None) -> None:
+        """
+        Replace the rules with the ones saved by save_snapshot. The snapshot is rejected with an exception if it was saved
+        with another format or library version or, when rules_list is given, if it was not built from rules_list and
+        variables (as in a single call of load_from_dicts). The stats of the rules are not restored.
+        Snapshots are pickle files: only load snapshots from trusted sources.
+
+        :param path: snapshot file path
+        :type path: str
+        :param rules_list: source rules of the snapshot, to check that the snapshot is up to date
+        :type rules_list: Optional[List[dict]]
+        :param variables: variables of the source rules
+        :type variables: Optional[dict]
+        :return: no value
+        :rtype: None
+        """
+        with open(path, "rb") as file:
+            try:
+                header = pickle.load(file)
+            except Exception as e:
+                self.logger.error(f"Invalid snapshot {path}: {e}")
+                raise ValueError(f"Invalid snapshot {path}: {e}")
+            if not isinstance(header, dict) or header.get("format") != SNAPSHOT_FORMAT or header.get("version") != __version__:
+                self.logger.error(f"Invalid snapshot {path}: it was not saved by routingfilter {__version__}")
+                raise ValueError(f"Invalid snapshot {path}: it was not saved by routingfilter {__version__}")
+            if rules_list is not None and header["rules_digest"] != self._digest_sections("", self._iter_rule_dicts(rules_list), variables):
+                self.logger.error(f"Invalid snapshot {path}: it was not built from the given rules")
+                raise ValueError(f"Invalid snapshot {path}: it was not built from the given rules")
+            # the garbage collector would scan the objects being unpickled many times, without finding anything to free
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                streams, customer, snapshot_variables = pickle.load(file)
+            finally:
+                if gc_enabled:
+                    gc.enable()
+        for stream in (streams, customer):
+            stream.get_stats(delete=True)
+        self.streams, self.customer, self.variables = streams, customer, snapshot_variables
+        self.rules_digest = header["rules_digest"]
+
+    @classmethod
+    def _digest_sections(cls, digest: str, sections: Iterable[Tuple[str, Iterable[Tuple[str, Iterable[dict]]]]], variables: Optional[dict]) -> str:
+        """
+        Return the digest of the rules loaded so far updated with the rules of sections and variables, as loaded by
+        load_from_dicts and load_from_files. Each rule is hashed together with its stream type, its tag and the previous
+        digest, so the digest depends on all the rules loaded and on their order, but not on the files containing them.
+
+        :param digest: digest of the rules loaded so far, empty if none
+        :type digest: str
+        :param sections: stream type and tags, with their rules, of each stream section
+        :type sections: Iterable[Tuple[str, Iterable[Tuple[str, Iterable[dict]]]]]
+        :param variables: variables of the rules
+        :type variables: Optional[dict]
+        :return: hexadecimal digest
+        :rtype: str
+        """
+        if variables:
+            digest = cls._digest(digest, variables)
+        for stream_type, tags in sections:
+            for tag, rules in tags:
+                for rule in rules:
+                    digest = cls._digest(digest, [stream_type, tag, rule])
+        return digest
+
+    @staticmethod
+    def _digest(digest: str, value) -> str:
+        """
+        Return the digest of the json value hashed together with the previous digest.
+
+        :param digest: previous digest, empty if none
+        :type digest: str
+        :param value: json value
+        :type value: any
+        :return: hexadecimal digest
+        :rtype: str
+        """
+        return hashlib.sha256((digest + json.dumps(value, sort_keys=True, default=str)).encode()).hexdigest()
+
+    @staticmethod
+    def _share_stats(old_stream: Stream, new_stream: Stream) -> None:
+        """
+        Make the rules of new_stream use the stats of the rules of old_stream with the same id. The stats are shared, not
+        copied, so that the hits of the matches still running on old_stream are counted.
+
+        :param old_stream: stream with the current rules
+        :type old_stream: Stream
+        :param new_stream: stream with the new rules
+        :type new_stream: Stream
+        :return: no value
+        :rtype: None
+        """
+        old_stats = {}
+        for rule_manager in old_stream._ruleManagers.values():
+            for rule in rule_manager.rules():
+                old_stats.setdefault(rule.uid, rule._stats)
+        for rule_manager in new_stream._ruleManagers.values():
+            for rule in rule_manager.rules():
+                if rule.uid in old_stats:
+                    rule._stats = old_stats[rule.uid]
+
+    @staticmethod
+    def _intern_filter(new_filter: filters.AbstractFilter, filter_pool: dict) -> filters.AbstractFilter:
+        """
+        Return the filter of the pool identical to new_filter, or new_filter if there is none. Filters used by more than
+        one rule are marked as shared.
+
+        :param new_filter: filter to intern
+        :type new_filter: filters.AbstractFilter
+        :param filter_pool: filters by signature
+        :type filter_pool: dict
+        :return: the interned filter
+        :rtype: filters.AbstractFilter
+        """
+        if new_filter is None:
+            return new_filter
+        try:
+            interned = filter_pool.setdefault(new_filter.signature(), new_filter)
+        except TypeError:
+            # values that cannot be hashed
+            return new_filter
+        if interned is not new_filter:
+            interned._shared = True
+        return interned
 
     def _get_filters(self, rule: dict, variables: Optional[dict]) -> List[filters.AbstractFilter]:
         """
@@ -156,9 +738,9 @@ class Routing:
         filters_list = []
         for el in rule["filters"]:
             keys = el["key"] if "key" in el.keys() else None
-            if variables:  # substitute variables for each filter
-                el["value"] = self._substitute_variables(el["value"])
             values = el["value"] if "value" in el.keys() else None
+            if variables and values is not None:  # substitute variables for each filter
+                values = self._substitute_variables(values)
             new_filter = None
             match el["type"]:
                 case "ALL":
@@ -193,32 +775,49 @@ class Routing:
             filters_list.append(new_filter)
         return filters_list
 
-    def _substitute_variables(self, values: str) -> List | str:
+    def _substitute_variables(self, values: str | List) -> filters.SharedValues | List | str:
         """
-        Map a variable name into its value, if defined in variables dictionary.
+        Map variable names into their values, if defined in variables dictionary. The values of the same variable names
+        are a single SharedValues object, so that all the filters using them share the checked values.
 
-        :param values: variable name
-        :type values: str
-        :return: list of variable value or, if not defined, the variable name
-        :rtype: list or str
+        :param values: variable name or list of variable names and values
+        :type values: str | List
+        :return: values of the variables or, if no variable is defined, values
+        :rtype: filters.SharedValues | List | str
         """
-        variable_values = []
         if not isinstance(values, list):
             values = [values]
+        if self._variables_pool[0] is not self.variables:
+            # variables changed: the values are built again from the new ones
+            self._variables_pool = (self.variables, {})
+        shared_values_pool = self._variables_pool[1]
+        try:
+            pool_key = tuple(values)
+            return shared_values_pool[pool_key]
+        except TypeError:
+            # values that cannot be hashed
+            pool_key = None
+        except KeyError:
+            pass
+        variable_values = []
+        found = False
         for value in values:
             if value in self.variables:
-                if not isinstance(self.variables[value], list):
-                    self.variables[value] = [self.variables[value]]
-                variable_values.extend(self.variables[value])
+                found = True
+                variable_value = self.variables[value]
+                variable_values.extend(variable_value if isinstance(variable_value, list) else [variable_value])
             elif not value.startswith("$"):
                 variable_values.append(value)
-        if variable_values:
-            res = variable_values
-        else:
-            res = values
+        if not variable_values:
+            return values
+        if not found:
+            return variable_values
+        res = filters.SharedValues(variable_values)
+        if pool_key is not None:
+            shared_values_pool[pool_key] = res
         return res
 
-    def load_from_jsons(self, rule_list: List[str], validate_rules: bool = True, variables: Optional[dict] = None) -> None:
+    def load_from_jsons(self, rule_list: List[str], validate_rules: bool = True, variables: Optional[dict] = None, **kwargs) -> None:
         """
         Load routing rule configurations from json data.
 
@@ -228,13 +827,15 @@ class Routing:
         :type validate_rules: bool
         :param variables:
         :type variables: Optional[dict]
+        :param kwargs: other arguments of load_from_dicts (e.g. compile_rules)
+        :type kwargs: dict
         :return: no value
         :rtype: None
         """
         if not isinstance(rule_list, list):
             raise ValueError(f"Invalid rule_list {rule_list}: it must be a list of json data")
         try:
-            rule_list[:] = [json.loads(rule) for rule in rule_list]
+            rules_list = [json.loads(rule) for rule in rule_list]
         except TypeError:
             self.logger.error(f"Invalid rule_list {rule_list}: each rule file must be a string")
             raise ValueError(f"Invalid rule_list {rule_list}: each rule file must be a string")
@@ -242,4 +843,4 @@ class Routing:
             self.logger.error(f"Invalid rule_list {rule_list}: each rule file must be a json data")
             raise ValueError(f"Invalid rule_list {rule_list}: each rule file must be a json data")
 
-        self.load_from_dicts(rule_list, validate_rules, variables)
+        self.load_from_dicts(rules_list, validate_rules, variables, **kwargs)
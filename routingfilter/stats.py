@@ -0,0 +1,221 @@
+import heapq
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+# name of the hits counted by TotalStats
+TOTAL_KEY = "total"
+
+
+class Stats(ABC):
+    """Hits of a rule by event name (the "rule.name" field of the events), collected when the rule matches.
+
+    Routing creates a Stats object for each rule with the factory passed as its stats argument: ExactStats (the default)
+    counts every name, while the other classes take bounded memory and time however many names the events have.
+    Backends implement add and get: classes missing either of them cannot be instantiated.
+    """
+
+    __slots__ = ()
+
+    @abstractmethod
+    def add(self, name: str, hits: int = 1) -> None:
+        """
+        Add hits to the hits of name.
+
+        :param name: event name
+        :type name: str
+        :param hits: number of hits
+        :type hits: int
+        :return: no value
+        :rtype: None
+        """
+        return NotImplemented
+
+    @abstractmethod
+    def get(self, delete: bool = False) -> Dict[str, int]:
+        """
+        Return the hits by event name. If delete is True, reset the hits.
+
+        :param delete: if True, reset the hits
+        :type delete: bool
+        :return: hits by event name
+        :rtype: Dict[str, int]
+        """
+        return NotImplemented
+
+    def merge(self, hits: Dict[str, int]) -> None:
+        """
+        Add hits, in the format returned by get (e.g. the hits collected by another process).
+
+        :param hits: hits by event name
+        :type hits: Dict[str, int]
+        :return: no value
+        :rtype: None
+        """
+        for name, name_hits in hits.items():
+            self.add(name, name_hits)
+
+
+class ExactStats(Stats):
+    """Stats with the exact hits of every event name. Memory grows with the number of names, until the hits are deleted."""
+
+    __slots__ = ("_hits",)
+
+    def __init__(self):
+        self._hits = {}
+
+    def add(self, name: str, hits: int = 1) -> None:
+        self._hits[name] = self._hits.get(name, 0) + hits
+
+    def get(self, delete: bool = False) -> Dict[str, int]:
+        hits = self._hits
+        if delete:
+            self._hits = {}
+        return hits
+
+
+class TopKStats(Stats):
+    """Stats with the hits of the k most frequent event names, counted with the space-saving algorithm.
+
+    When a new name arrives and k names are already counted, it replaces the name with the fewest hits and inherits its
+    hits: the hits of each name are an upper bound, exact for the names counted since their first hit, and every name with
+    more than 1/k of the hits is counted. Names are grouped by number of hits, so that each hit takes constant time.
+    """
+
+    __slots__ = ("k", "_hits", "_buckets", "_min")
+
+    def __init__(self, k: int = 100):
+        """
+        :param k: maximum number of event names counted
+        :type k: int
+        """
+        if k < 1:
+            raise ValueError(f"Invalid k {k}: it must be a positive integer")
+        self.k = k
+        self._reset()
+
+    def _reset(self) -> None:
+        self._hits = {}
+        # names (as keys of a dictionary, which keeps the insertion order) by number of hits
+        self._buckets: Dict[int, Dict[str, None]] = {}
+        self._min = 0
+
+    def add(self, name: str, hits: int = 1) -> None:
+        name_hits, buckets = self._hits, self._buckets
+        count = name_hits.get(name)
+        if count is None and len(name_hits) >= self.k:
+            # the oldest name with the fewest hits is replaced
+            count = self._min
+            bucket = buckets[count]
+            victim = next(iter(bucket))
+            del bucket[victim]
+            del name_hits[victim]
+        elif count is None:
+            count = 0
+            bucket = None
+        else:
+            bucket = buckets[count]
+            del bucket[name]
+        if bucket is not None and not bucket:
+            del buckets[count]
+        count += hits
+        name_hits[name] = count
+        buckets.setdefault(count, {})[name] = None
+        if count < self._min or self._min not in buckets:
+            # with a single hit, the name leaving the emptied minimum bucket is the only one in the next bucket
+            self._min = count if hits == 1 else min(buckets)
+
+    def get(self, delete: bool = False) -> Dict[str, int]:
+        hits = dict(self._hits)
+        if delete:
+            self._reset()
+        return hits
+
+
+class CountMinStats(Stats):
+    """Stats estimating the hits of each event name with a count-min sketch, reporting the heavy_hitters names with more hits.
+
+    The sketch has depth rows of width counters: a name increments a counter of each row and its hits are estimated with
+    the minimum of its counters, which is an upper bound exceeding the exact hits by at most e/width of the total hits
+    with probability 1 - exp(-depth). Memory depends only on width, depth and heavy_hitters, and each hit takes
+    O(depth + log(heavy_hitters)) amortized time. The sketch uses the Python hash of the names, so it is meaningful only in the process that built it: processes
+    exchange the heavy hitters returned by get (see merge).
+    """
+
+    __slots__ = ("width", "depth", "heavy_hitters", "_counters", "_heavy", "_heavy_heap")
+
+    def __init__(self, width: int = 2048, depth: int = 4, heavy_hitters: int = 100):
+        """
+        :param width: number of counters of each row
+        :type width: int
+        :param depth: number of rows
+        :type depth: int
+        :param heavy_hitters: number of event names reported by get
+        :type heavy_hitters: int
+        """
+        if width < 1 or depth < 1 or heavy_hitters < 1:
+            raise ValueError(f"Invalid sketch size {width}x{depth} with {heavy_hitters} heavy hitters: they must be positive integers")
+        self.width = width
+        self.depth = depth
+        self.heavy_hitters = heavy_hitters
+        self._reset()
+
+    def _reset(self) -> None:
+        self._counters: List[List[int]] = [[0] * self.width for _ in range(self.depth)]
+        # estimated hits of the heavy hitters
+        self._heavy: Dict[str, int] = {}
+        # min-heap with an entry for each heavy hitter: estimates only grow, so the hits of an entry are a lower bound,
+        # updated only when the entry reaches the top of the heap
+        self._heavy_heap: List[Tuple[int, str]] = []
+
+    def add(self, name: str, hits: int = 1) -> None:
+        # the counter of each row is given by two halves of a single hash (double hashing)
+        name_hash = hash(name)
+        index, step = name_hash & 0xFFFFFFFF, (name_hash >> 32) | 1
+        width = self.width
+        estimate = None
+        for counters in self._counters:
+            index %= width
+            counters[index] += hits
+            if estimate is None or counters[index] < estimate:
+                estimate = counters[index]
+            index += step
+        heavy, heap = self._heavy, self._heavy_heap
+        if name in heavy:
+            heavy[name] = estimate
+        elif len(heavy) < self.heavy_hitters:
+            heavy[name] = estimate
+            heapq.heappush(heap, (estimate, name))
+        else:
+            # the outdated entries at the top of the heap are updated, until the top is the heavy hitter with fewest hits
+            while heap[0][0] != heavy[heap[0][1]]:
+                heapq.heapreplace(heap, (heavy[heap[0][1]], heap[0][1]))
+            if estimate > heap[0][0]:
+                del heavy[heapq.heapreplace(heap, (estimate, name))[1]]
+                heavy[name] = estimate
+
+    def get(self, delete: bool = False) -> Dict[str, int]:
+        hits = dict(self._heavy)
+        if delete:
+            self._reset()
+        return hits
+
+
+class TotalStats(Stats):
+    """Stats with only the total hits of the rule, returned with the TOTAL_KEY name."""
+
+    __slots__ = ("_total",)
+
+    def __init__(self):
+        self._total = 0
+
+    def add(self, name: str, hits: int = 1) -> None:
+        self._total += hits
+
+    def get(self, delete: bool = False) -> Dict[str, int]:
+        hits = {TOTAL_KEY: self._total} if self._total else {}
+        if delete:
+            self._total = 0
+        return hits
+
+    def merge(self, hits: Dict[str, int]) -> None:
+        self._total += sum(hits.values())
@@ -1,14 +1,22 @@
+import re
+
 from setuptools import find_packages, setup
 
 with open("README.md", "r") as readme_file:
     long_description = readme_file.read()
 
+# the version is defined once, in routingfilter.__version__, which snapshots are checked against
+with open("routingfilter/__init__.py", "r") as init_file:
+    version = re.search(r'^__version__ = "([^"]+)"', init_file.read(), re.MULTILINE).group(1)
+
 setup(
     name="routingfilter",
-    version="2.3.3",
+    version=version,
     packages=find_packages(include=["routingfilter", "routingfilter.*"]),
     include_package_data=True,
     install_requires=["IPy~=1.1", "macaddress~=2.0.2"],
+    extras_require={"orjson": ["orjson"]},
+    entry_points={"console_scripts": ["routingfilter=routingfilter.__main__:main"]},
     url="https://github.com/certego/RoutingFilter",
     license="GNU LGPLv3",
     author="Certego S.r.l.",